@@ -0,0 +1,74 @@
+"""Compares lib.dsp against the audioop operations it replaced.
+
+Run from the repo root with `python -m bench.dsp`. audioop is optional, as it no longer
+exists from Python 3.13 onwards; without it only the lib.dsp timings are reported.
+"""
+
+import warnings
+from timeit import Timer
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from lib import dsp
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    try:
+        import audioop as ao
+
+        HAVE_AUDIOOP = True
+    except ImportError:
+        HAVE_AUDIOOP = False
+
+FRAME_BYTES = 3840
+BUFFER_SECONDS = 10
+SAMPLE_WIDTH_BYTES = 2
+
+
+def _time(fn: Callable, size_bytes: int) -> str:
+    loops, total = Timer(fn).autorange()
+    per_call = total / loops
+    throughput = size_bytes / per_call / 1e6
+
+    return f"{per_call * 1e6:10.1f} us/op {throughput:10.1f} MB/s"
+
+
+def _audioop_ops(a: bytes, b: bytes) -> Dict[str, Callable]:
+    return {
+        "add": lambda: ao.add(a, b, SAMPLE_WIDTH_BYTES),
+        "gain": lambda: ao.mul(a, SAMPLE_WIDTH_BYTES, 0.5),
+        "reverse": lambda: ao.reverse(a, SAMPLE_WIDTH_BYTES),
+        "resample": lambda: ao.ratecv(a, SAMPLE_WIDTH_BYTES, dsp.CHANNELS, dsp.SAMPLE_RATE, 24000, None),
+    }
+
+
+def _dsp_ops(a: np.ndarray, b: np.ndarray) -> Dict[str, Callable]:
+    return {
+        # Mixing sums into an int32 frame and saturates once, as Mixer does
+        "add": lambda: dsp.saturate(a.astype(np.int32) + b),
+        "gain": lambda: dsp.gain(a, 0.5),
+        "reverse": lambda: dsp.reverse(a),
+        "resample": lambda: dsp.resize(dsp.as_frames(a), a.size // dsp.CHANNELS // 2),
+        "trim": lambda: dsp.trim_silence(a),
+        "normalize": lambda: dsp.normalize_loudness(a),
+    }
+
+
+def run(label: str, size_bytes: int, rng: np.random.Generator):
+    a = rng.integers(dsp.INT16_MIN, dsp.INT16_MAX, size_bytes // SAMPLE_WIDTH_BYTES, dtype=np.int16)
+    b = rng.integers(dsp.INT16_MIN, dsp.INT16_MAX, size_bytes // SAMPLE_WIDTH_BYTES, dtype=np.int16)
+
+    reference: Optional[Dict[str, Callable]] = _audioop_ops(a.tobytes(), b.tobytes()) if HAVE_AUDIOOP else None
+
+    print(f"== {label} ({size_bytes} bytes) ==")
+    for name, fn in _dsp_ops(a, b).items():
+        print(f"{name:>8}  dsp     {_time(fn, size_bytes)}")
+        if reference and name in reference:
+            print(f"{name:>8}  audioop {_time(reference[name], size_bytes)}")
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    run("per frame", FRAME_BYTES, rng)
+    run(f"per buffer ({BUFFER_SECONDS}s)", dsp.SAMPLE_RATE * dsp.CHANNELS * SAMPLE_WIDTH_BYTES * BUFFER_SECONDS, rng)
@@ -0,0 +1,75 @@
+"""Measures whether one core can keep N guilds' voice sessions inside the 20ms frame deadline.
+
+Each simulated guild has its own Mixer with a handful of stacked tracks, like a busy voice
+session. Every tick reads one frame from every guild back to back, as discord.py's player
+threads would share one core under the GIL, and times the whole tick. When libopus is
+available the frames are also Opus encoded, which is what discord.py does next with them.
+Encoding is most of the cost of a frame, so runs without libopus only measure the mixing
+and say nothing about how many guilds fit in the deadline.
+
+Run from the repo root with `python -m bench.guilds [--guilds 1 10 50] [--tracks 4]`.
+"""
+
+import argparse
+import time
+
+import numpy as np
+from discord import opus
+
+from lib import dsp
+from lib.audio import Buffer, Mixer
+
+FRAME_DEADLINE_MS = 20
+TICKS = 500
+
+
+def make_sounds(count: int, seconds: float, rng: np.random.Generator):
+    samples = int(dsp.SAMPLE_RATE * seconds) * dsp.CHANNELS
+    return [rng.integers(-8000, 8000, samples, dtype=np.int16) for _ in range(count)]
+
+
+def run(guilds: int, tracks: int, encode: bool, rng: np.random.Generator):
+    # Sounds long enough to outlast the run, so every tick mixes the full number of tracks
+    sounds = make_sounds(tracks, TICKS * FRAME_DEADLINE_MS / 1000 + 1, rng)
+
+    mixers = []
+    for _ in range(guilds):
+        mixer = Mixer()
+        for sound in sounds:
+            mixer.add(Buffer(sound))
+        mixers.append(mixer)
+
+    encoders = [opus.Encoder() for _ in range(guilds)] if encode else []
+
+    timings = np.empty(TICKS)
+    for tick in range(TICKS):
+        start = time.perf_counter()
+        for i, mixer in enumerate(mixers):
+            frame = mixer.read()
+            if encode:
+                encoders[i].encode(frame, opus.Encoder.SAMPLES_PER_FRAME)
+        timings[tick] = (time.perf_counter() - start) * 1000
+
+    p50, p99 = np.percentile(timings, [50, 99])
+    misses = int((timings > FRAME_DEADLINE_MS).sum())
+    print(
+        f"{guilds:>5} guilds x {tracks} tracks: p50 {p50:6.2f}ms  p99 {p99:6.2f}ms  max {timings.max():6.2f}ms  "
+        + f"deadline misses {misses}/{TICKS}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, nargs="+", default=[1, 5, 10, 25, 50, 100])
+    parser.add_argument("--tracks", type=int, default=4)
+    args = parser.parse_args()
+
+    encode = opus.is_loaded() or opus._load_default()
+    if encode:
+        print("Opus encoding included")
+    else:
+        print("Opus encoding not available, so these are mixing times only and understate the cost of a frame")
+
+    rng = np.random.default_rng(0)
+    for guilds in args.guilds:
+        run(guilds, args.tracks, encode, rng)
@@ -0,0 +1,165 @@
+"""Plays sounds through a Mixer the way discord.py's player thread does, on a simulated clock, so
+the voice path can be stress tested without Discord, Firebase or a voice channel.
+
+The player reads one frame every 20ms. Here, frame n is due to start at n * 20ms of simulated
+time, and has to be read before frame n + 1 is due. The clock only moves forward by how long
+reads (and the stacks and reversals injected between them) really take, so a slow read shows
+up as a deadline miss instead of the run taking longer. Sounds are synthetic WAV fixtures,
+prepared the same way cached secrets are.
+
+Run from the repo root with `python -m bench.realtime [--seconds 30] [--stack-every 0.2]`.
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+import wave
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from lib import dsp
+from lib.audio import SAMPLE_READ_SIZE, Buffer, Mixer, prepare_sound
+
+FRAME_MS = 20
+
+
+def write_fixtures(directory: Path, rng: np.random.Generator) -> Dict[str, Path]:
+    """Writes a few 48kHz 16-bit WAV files which look like typical secrets to directory."""
+    rate = dsp.SAMPLE_RATE
+    t = np.arange(rate * 2) / rate
+
+    tone = np.sin(2 * np.pi * 440 * t) * 8000
+    # A short, decaying "voice" clip in mono, with silence either side like most recordings
+    voice = np.sin(2 * np.pi * 220 * t[: rate // 2]) * np.exp(-4 * t[: rate // 2]) * 20000
+    voice = np.concatenate((np.zeros(rate // 4), voice, np.zeros(rate // 4)))
+    noise = rng.normal(0, 3000, (int(rate * 1.5), dsp.CHANNELS))
+
+    fixtures = {
+        "tone": np.stack((tone, tone * 0.5), axis=1),
+        "noise": noise,
+        "voice": voice[:, None],
+    }
+
+    paths = {}
+    for name, samples in fixtures.items():
+        paths[name] = directory / f"{name}.wav"
+        with wave.open(str(paths[name]), "wb") as fp:
+            fp.setnchannels(samples.shape[1])
+            fp.setsampwidth(2)
+            fp.setframerate(rate)
+            fp.writeframes(dsp.saturate(samples).tobytes())
+
+    return paths
+
+
+def load_wav(path: Path) -> np.ndarray:
+    """Reads a 48kHz 16-bit WAV file as (frames, channels) samples."""
+    with wave.open(str(path), "rb") as fp:
+        if fp.getframerate() != dsp.SAMPLE_RATE or fp.getsampwidth() != 2:
+            raise ValueError(f"{path} should be 48kHz 16-bit")
+        samples = np.frombuffer(fp.readframes(fp.getnframes()), dtype=np.int16)
+        return samples.reshape(-1, fp.getnchannels())
+
+
+@dataclass
+class Report:
+    frames: int = 0
+    misses: int = 0
+    silent: int = 0
+    read_ms: List[float] = field(default_factory=list)
+    operation_ms: List[float] = field(default_factory=list)
+    resident_bytes: int = 0
+    peak_bytes: int = 0
+
+    def summary(self) -> str:
+        reads = np.array(self.read_ms)
+        operations = np.array(self.operation_ms or [0.0])
+        p50, p99 = np.percentile(reads, [50, 99])
+        return (
+            f"{self.frames} frames: read p50 {p50:.3f}ms  p99 {p99:.3f}ms  max {reads.max():.3f}ms\n"
+            + f"{len(self.operation_ms)} stacks/reversals: p99 {np.percentile(operations, 99):.3f}ms  "
+            + f"max {operations.max():.3f}ms\n"
+            + f"Deadline misses: {self.misses}/{self.frames}, silent frames: {self.silent}\n"
+            + f"Sounds resident: {self.resident_bytes / 1024:.0f} KB, peak allocated while playing: "
+            + f"{self.peak_bytes / 1024:.0f} KB"
+        )
+
+
+def simulate(
+    sounds: List[np.ndarray],
+    seconds: float,
+    stack_every: float,
+    reverse_every: float,
+    rng: np.random.Generator,
+    max_voices: int = 32,
+) -> Report:
+    """Plays for `seconds` of simulated time, stacking a random sound every `stack_every` seconds and
+    reversing everything every `reverse_every` seconds.
+    """
+    report = Report(resident_bytes=sum(sound.nbytes for sound in sounds))
+    mixer = Mixer(max_voices)
+    mixer.add(Buffer(sounds[0]))
+
+    clock = 0.0
+    next_stack, next_reverse = stack_every * 1000, reverse_every * 1000
+    for n in range(int(seconds * 1000 / FRAME_MS)):
+        # The player sleeps until the frame is due, unless it is already running late
+        clock = max(clock, n * FRAME_MS)
+
+        # Commands handled on the event loop hold the GIL, and so hold up the player too
+        while min(next_stack, next_reverse) <= clock:
+            start = time.perf_counter()
+            if next_stack <= next_reverse:
+                mixer.add(Buffer(sounds[rng.integers(len(sounds))]))
+                next_stack += stack_every * 1000
+            else:
+                mixer.reverse()
+                next_reverse += reverse_every * 1000
+            elapsed = (time.perf_counter() - start) * 1000
+            report.operation_ms.append(elapsed)
+            clock += elapsed
+
+        start = time.perf_counter()
+        frame = mixer.read()
+        elapsed = (time.perf_counter() - start) * 1000
+
+        clock += elapsed
+        report.frames += 1
+        report.read_ms.append(elapsed)
+        report.misses += clock > (n + 1) * FRAME_MS
+        if len(frame) != SAMPLE_READ_SIZE:
+            report.silent += 1
+            mixer.add(Buffer(sounds[rng.integers(len(sounds))]))
+
+    return report
+
+
+def run(seconds: float, stack_every: float, reverse_every: float, seed: int = 0) -> Report:
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = write_fixtures(Path(directory), np.random.default_rng(seed))
+        sounds = [prepare_sound(load_wav(path)) for path in fixtures.values()]
+
+    report = simulate(sounds, seconds, stack_every, reverse_every, np.random.default_rng(seed))
+
+    # Measure memory on a second, identical run, so tracing doesn't skew the timings
+    tracemalloc.start()
+    simulate(sounds, seconds, stack_every, reverse_every, np.random.default_rng(seed))
+    report.peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--stack-every", type=float, default=0.2)
+    parser.add_argument("--reverse-every", type=float, default=1.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(run(args.seconds, args.stack_every, args.reverse_every, args.seed).summary())
@@ -0,0 +1,87 @@
+"""Compares checking text and regex secrets one at a time against lib.matcher.SecretMatcher.
+
+Secrets are random words and phrases, with a share of regex secrets shaped like the real ones
+(`h+m+`, `lo+l`, ...). Messages are short chat lines and long pasted walls of text, most of which
+match nothing, as most messages do. Both approaches must give the same response for every
+message, which is checked before anything is timed.
+
+Run from the repo root with `python -m bench.secrets [--secrets 100 1000 5000]`.
+"""
+
+import argparse
+import random
+import re
+from timeit import Timer
+from typing import Dict, List, Optional
+
+from lib.matcher import SecretMatcher
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def make_secrets(count: int, rng: random.Random):
+    words = ["".join(rng.choice(LETTERS) for _ in range(rng.randint(3, 9))) for _ in range(count)]
+    text_secrets = {f"{word} {rng.choice(words)}" if rng.random() < 0.3 else word: word.upper() for word in words}
+
+    regex_secrets = {}
+    for word in words[: count // 10]:
+        # Stretchy words, e.g. "hmm" -> "h+m+"
+        regex_secrets["".join(f"{char}+" for char in word[:4])] = word.title()
+
+    return regex_secrets, text_secrets
+
+
+def make_messages(count: int, length: int, text_secrets: Dict[str, str], rng: random.Random) -> List[str]:
+    # Words which don't contain a secret, as random letters soon would, so messages read like chat
+    # that triggers nothing and every text secret has to be ruled out
+    words = ["".join(rng.choice(LETTERS) for _ in range(rng.randint(2, 8))) for _ in range(2000)]
+    words = [word for word in words if not any(text in word for text in text_secrets if " " not in text)]
+    return [" ".join(rng.choice(words) for _ in range(length)) for _ in range(count)]
+
+
+def linear(regex_secrets: Dict[re.Pattern, str], text_secrets: Dict[str, str], content: str) -> Optional[str]:
+    """How secrets were checked before SecretMatcher."""
+    for regex, response in regex_secrets.items():
+        if regex.search(content) is not None:
+            return response
+
+    for text, response in text_secrets.items():
+        if text in content:
+            return response
+
+    return None
+
+
+def run(count: int, rng: random.Random):
+    regex_secrets, text_secrets = make_secrets(count, rng)
+    compiled = {re.compile(rf"^{k}$", flags=re.IGNORECASE): v for k, v in regex_secrets.items()}
+    matcher = SecretMatcher(regex_secrets, text_secrets)
+
+    for name, length in [("short", 8), ("long", 400)]:
+        messages = make_messages(200, length, text_secrets, rng)
+        # A few messages which do hit secrets
+        messages += [rng.choice(list(text_secrets)) for _ in range(5)] + ["h" * 5 + "m" * 3]
+
+        for message in messages:
+            assert linear(compiled, text_secrets, message) == matcher.match(message), message
+
+        results = []
+        for label, check in [
+            ("linear", lambda: [linear(compiled, text_secrets, message) for message in messages]),
+            ("matcher", lambda: [matcher.match(message) for message in messages]),
+        ]:
+            loops, total = Timer(check).autorange()
+            results.append(f"{label} {total / loops / len(messages) * 1e6:9.1f} us/msg")
+
+        print(f"{count:>6} secrets, {name:>5} messages: " + "  ".join(results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--secrets", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for count in args.secrets:
+        run(count, rng)
@@ -3,12 +3,14 @@ from random import choice
 from string import ascii_lowercase, digits
 from typing import Optional
 
+from discord import Member
 from discord.ext import commands
 from discord.ext.commands.context import Context
 from requests import post
 
 from lib.config import SONG_TRANSLATE_DOMAINS
 from lib.logger import logger
+from lib.passive import video_jobs
 from lib.utils import secrets_disabled
 
 SONGWHIP_URL = "https://songwhip.com/"
@@ -25,6 +27,10 @@ class External(commands.Cog, description="Commands that talk to the outside worl
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
+    def cog_unload(self):
+        # Stops the worker processes, the next video starts them again
+        video_jobs.shutdown()
+
     def get_songwhip(self, url: str) -> SongwhipResponse:
         # curl --request POST --data '{"url":"MY_SOURCE_MUSIC_LINK"}'
         req = post(SONGWHIP_URL, json={"url": url})
@@ -78,6 +84,36 @@ class External(commands.Cog, description="Commands that talk to the outside worl
 
         return await ctx.message.remove_reaction("🔃", self.bot.user)
 
+    @commands.command(description="Cancels the videos you asked for in this server, or everyone's for admins")
+    async def cancel_videos(self, ctx: Context):
+        everyone = await self.bot.is_owner(ctx.author) or (
+            isinstance(ctx.author, Member) and ctx.author.guild_permissions.administrator
+        )
+        cancelled = video_jobs.cancel(ctx.guild.id if ctx.guild else None, None if everyone else ctx.author.id)
+        await ctx.reply(f"Cancelled {cancelled} video(s)" if cancelled else "No videos are being grabbed")
+
+    @commands.is_owner()
+    @commands.command(description="Shows how many videos are waiting to be grabbed and how long grabs take")
+    async def video_stats(self, ctx: Context):
+        wait_p50, wait_p99, _ = video_jobs.waits.summary()
+        run_p50, run_p99, run_max = video_jobs.durations.summary()
+        compress_p50, compress_p99, _ = video_jobs.compressions.summary()
+        last = video_jobs.last_video
+        last_sizes = (
+            f"\nLast video: {last.downloaded_bytes / 1024 / 1024:.1f} MB downloaded, "
+            + f"{last.output_bytes / 1024 / 1024:.1f} MB sent"
+            if last is not None
+            else ""
+        )
+        await ctx.send(
+            f"🎞️ **{video_jobs.running}**/{video_jobs.workers} grabbing, {video_jobs.depth} waiting "
+            + f"(peak {video_jobs.peak_depth})\n"
+            + f"Waited p50 {wait_p50 / 1000:.1f}s  p99 {wait_p99 / 1000:.1f}s over {video_jobs.waits.count} jobs\n"
+            + f"Took p50 {run_p50 / 1000:.1f}s  p99 {run_p99 / 1000:.1f}s  max {run_max / 1000:.1f}s, "
+            + f"compressing p50 {compress_p50 / 1000:.1f}s  p99 {compress_p99 / 1000:.1f}s"
+            + last_sizes
+        )
+
 
 async def setup(bot):
     await bot.add_cog(External(bot))
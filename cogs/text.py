@@ -1,12 +1,23 @@
+import asyncio
 import re
 from copy import copy
 from functools import wraps
 from random import randint, random
 from typing import Any, Optional
 
-from discord.ext.commands import Bot, Cog, Command, Context, command  # type: ignore
+from discord.ext.commands import (  # type: ignore
+    Bot,
+    Cog,
+    Command,
+    Context,
+    command,
+    is_owner,
+)
 
+from lib import passive
 from lib.api import dynamodb
+from lib.config import SECRETS_RELOAD_SECONDS
+from lib.logger import logger
 from lib.utils import Constants, char_to_block, partition_message, secrets_disabled
 
 
@@ -21,6 +32,39 @@ class Text(Cog, description="Commands which mostly manipulate/send text"):  # ty
         self.pastas = list(dynamodb.get_item(Key={"id": "pastas"}).get("Item", {}).get("data", []))
         if not self.pastas:
             print("WARNING: NO PASTAS FOUND")
+        self.secrets_poll: Optional[asyncio.Task] = None
+
+    def cog_unload(self):
+        if self.secrets_poll is not None:
+            self.secrets_poll.cancel()
+
+    async def _poll_secrets(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await passive.reload_secrets(only_if_changed=True)
+            except Exception as e:
+                # Keep the matcher we have, and try again next time
+                logger.warning(f"Failed to reload secrets: {e}")
+
+    @Cog.listener()
+    async def on_ready(self):
+        if SECRETS_RELOAD_SECONDS > 0 and self.secrets_poll is None:
+            self.secrets_poll = asyncio.create_task(self._poll_secrets(SECRETS_RELOAD_SECONDS))
+
+    @is_owner()
+    @command(description="Reloads the text and regex secrets without restarting")
+    async def reload_secrets(self, ctx: Context):
+        try:
+            await passive.reload_secrets()
+        except Exception as e:
+            return await ctx.reply(f"Failed to reload secrets, keeping the current ones: {e}")
+
+        matcher = passive.secret_matcher
+        await ctx.reply(
+            f"Reloaded {len(passive.regex_secrets)} regex and {len(passive.text_secrets)} text secrets "
+            + f"({matcher.size} total)"
+        )
 
     def chainable(command: Any):
         """Used to indicate, and create, a chainable command. A chainable command is one
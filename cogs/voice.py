@@ -1,205 +1,189 @@
 import asyncio
-import audioop as ao
-import subprocess
 import time
 from dataclasses import dataclass
+from hashlib import sha1
 from pathlib import Path
-from typing import Dict, Optional, Set
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple, Union
 
+import aiohttp
 import numpy as np
-from discord import AudioSource, FFmpegPCMAudio, Member, PCMVolumeTransformer
+from discord import Member
 from discord.channel import VocalGuildChannel
 from discord.ext.commands import Cog, command, is_owner  # type: ignore
 from discord.ext.commands.bot import Bot
 from discord.ext.commands.context import Context
 from discord.member import VoiceState
 from discord.message import Message
-from discord.voice_client import VoiceClient
 
+from cogs.notifications import Notifications
+from lib import dsp
 from lib.api import dynamodb, firebase
-from lib.utils import secrets_disabled
+from lib.audio import Buffer, MixerQueueFull, PCMStream, StreamingBuffer, prepare_sound
+from lib.cache import SoundCache
+from lib.config import (
+    BROADCAST_MAX_BYTES,
+    BROADCAST_MAX_SECONDS,
+    DECODE_MAX_PENDING,
+    DECODE_WORKERS,
+    DISABLE_SECRETS_FOR_GUILDS,
+    MAX_MIXER_VOICES,
+    SOUND_BANK_DIR,
+    VOICE_ACTIVE_SECONDS,
+    VOICE_CACHE_MAX_BYTES,
+    VOICE_CACHE_PIN_AFTER,
+    VOICE_OPUS_CACHE,
+    VOICE_PREFETCH,
+    VOICE_PREFETCH_CONCURRENCY,
+    VOICE_QUEUE_MAX,
+    VOICE_SILENCE_DBFS,
+    VOICE_STREAM_VOLUME,
+    VOICE_TARGET_DBFS,
+    VOICE_WARM_CONNECT,
+    VOICE_WARM_IDLE_SECONDS,
+)
+from lib.decoder import (
+    DecodeLimitExceeded,
+    DecodeQueueFull,
+    DecodeService,
+    decode_url,
+)
+from lib.effects import parse_effect, parse_speed
+from lib.logger import logger
+from lib.mix import MixError, normalize, parse, render, sound_names
+from lib.opus import FRAME_SECONDS, OpusPackets, encode_opus
+from lib.sessions import SessionManager, VoiceSession
+from lib.soundbank import SoundBank, content_hash, diff_catalog
+from lib.timings import FRAME_BUDGET_MS
+from lib.triggers import Trigger, TriggerRegistry, classify
+from lib.utils import SingleFlight, secrets_disabled
 
 
 def current_milli_time():
     return round(time.time() * 1000)
 
 
-SAMPLE_READ_SIZE = 3840
-SAMPLE_WIDTH_BYTES = 2
-
-
 @dataclass
 class Helpers:
     BAD_JOIN = "You have to be in a voice channel in this server for me to join it"
     BAD_LEAVE = "I'm not in a voice channel in this server"
 
 
-class Operators:
-    @staticmethod
-    def combine_samples(a: Optional[bytes] = None, b: Optional[bytes] = None) -> bytes:
-        if a and b:
-            return ao.add(a, b, SAMPLE_WIDTH_BYTES)
-
-        return a or b or b""
-
-
 @dataclass
-class Buffer:
-    data: np.ndarray
-    ptr: int = 0
-
-    # effects = field(default_factory=list)
-
-    def read(self) -> bytes:
-        if self.ptr < self.data.size:
-            self.ptr += SAMPLE_READ_SIZE
-            return bytes(self.data[self.ptr - SAMPLE_READ_SIZE : self.ptr])
-
-        return b""
-
-    def reverse(self):
-        self.data = np.array(bytearray(ao.reverse(bytes(self.data), SAMPLE_WIDTH_BYTES)), dtype=np.int8)
-        self.ptr += ((self.data.size // 2) - self.ptr) * 2
-
-
-class AudioBufferWrapper(AudioSource):
-    def __init__(self, buffer: Buffer):
-        self.buffer = buffer
-
-    def _process(self):
-        return super()._process()
-
-    def cleanup(self):
-        pass
-
-    @staticmethod
-    def from_file(path):
-        data = FFmpegPCMAudio(path, before_options="-guess_layout_max 0", stderr=subprocess.PIPE)
-
-        # Copy buffer data from real audio source to an ndarray
-        buffer_data: bytearray = []
-        while next_ := data.read():
-            buffer_data += bytearray(next_)
+class AudioBufferWrapper:
+    """A loaded sound, ready to be played on a session's mixer. Not an AudioSource itself: sounds are only
+    ever played through a Mixer (or their pre-encoded Opus packets).
+    """
 
-        new_wrapper_instance = AudioBufferWrapper(Buffer(np.array(buffer_data, dtype=np.int8)))
-        data.cleanup()
-        buffer_data = None
-
-        return new_wrapper_instance
-
-    @staticmethod
-    def from_buffer_data(buffer_data: np.ndarray):
-        return AudioBufferWrapper(Buffer(buffer_data))
-
-    def read(self):
-        return self.buffer.read()
-
-    def reverse(self):
-        self.buffer.reverse()
-
-    def __add__(self, other):
-        """Combine this AudioBufferWrapper with another. Adds the audio buffers in each
-        wrapper together by merging samples of both. Takes the largest of the two buffers
-        as the reference buffer and layers the smaller buffer on top of this.
-
-        Args:
-            other (AudioBufferWrapper): The other AudioBufferWrapper to be added to this one.
-        """
-        # Start the copying some samples ahead to allow for processing delay (~40ms)
-        initial_ptr = self.buffer.ptr + SAMPLE_READ_SIZE * 2
-
-        data_a = self.buffer.data[initial_ptr:]
-        data_b = other.buffer.data
-
-        # TODO: Tidy this up. There must be a simpler and/or more efficient way to do this with Numpy
-        if data_a.size < data_b.size:
-            b_overlap, b_extra = data_b[: data_a.size], data_b[data_a.size :]
-            new_data = np.append(
-                np.array(bytearray(Operators.combine_samples(bytes(data_a), bytes(b_overlap))), dtype=np.int8),
-                b_extra,
-            )
-        elif data_b.size < data_a.size:
-            a_overlap, a_extra = data_a[: data_b.size], data_a[data_b.size :]
-            new_data = np.append(
-                np.array(bytearray(Operators.combine_samples(bytes(a_overlap), bytes(data_b))), dtype=np.int8),
-                a_extra,
-            )
-        else:
-            new_data = np.array(bytearray(Operators.combine_samples(bytes(data_a), bytes(data_b))), dtype=np.int8)
-
-        self.buffer.data = np.append(
-            self.buffer.data[:initial_ptr],
-            new_data,
-        )
-
-        # Manually clear to avoid GC?
-        new_data = None
+    buffer: Buffer
 
 
 class Voice(Cog, description="Commands related to voice"):  # type: ignore
-    voice_client: Optional[VoiceClient] = None
     voice_secrets: Dict[str, str] = {}
-    cached_voice_secrets: Dict[str, np.ndarray] = {}
+    secret_versions: Dict[str, Optional[str]] = {}
+    cached_voice_secrets: SoundCache
+    sound_bank: SoundBank
 
     def __init__(self, bot: Bot):
         self.bot = bot
-        self._update_secrets()
+        self.sessions = SessionManager(MAX_MIXER_VOICES)
+        self.cached_voice_secrets = SoundCache(VOICE_CACHE_MAX_BYTES, pin_after=VOICE_CACHE_PIN_AFTER)
+        self.sound_bank = SoundBank(Path(SOUND_BANK_DIR))
+        self.decoder = DecodeService(DECODE_WORKERS, DECODE_MAX_PENDING)
+        self.sound_loads = SingleFlight()
+        self.decoding: Dict[str, Tuple[PCMStream, asyncio.Task]] = {}
+        self.prefetch_task: Optional[asyncio.Task] = None
+        # When each member last played a secret, to guess who is going to play one next
+        self.recent_players: Dict[int, float] = {}
+        self.idle_disconnects: Dict[int, asyncio.Task] = {}
+        self.broadcasts: Set[asyncio.Task] = set()
+        self.http: Optional[aiohttp.ClientSession] = None
+
+        # The first of these which matches a message handles it
+        self.triggers: TriggerRegistry[Callable[[Message], Awaitable[None]]] = TriggerRegistry()
+        self.triggers.add(
+            Trigger(first_chars="&", secret=True),
+            lambda message: self.play_sound_by_file_name(message, message.content[1:], stack=True),
+        )
+        self.triggers.add(
+            Trigger(first_chars=">", secret=True),
+            lambda message: self.play_sound_by_file_name(message, message.content[1:], queue=True),
+        )
+        self.triggers.add(Trigger(first_chars="+", secret=True), self.apply_audio_operation_from_message)
+        self.triggers.add(Trigger(secret=True), lambda message: self.play_sound_by_file_name(message, message.content))
 
-    @property
-    def client_source(self) -> Optional[AudioBufferWrapper]:
-        if not self.voice_client:
-            return None
+        self._update_secrets()
 
-        if self.voice_client._player is not None:
-            if isinstance(self.voice_client._player.source, PCMVolumeTransformer):
-                return self.voice_client._player.source.original
+    async def cog_unload(self):
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+        for task in [*self.idle_disconnects.values(), *self.broadcasts]:
+            task.cancel()
+        self.decoder.shutdown()
+        if self.http is not None:
+            await self.http.close()
 
-        return None
+    def session_for(self, message: Message) -> Optional[VoiceSession]:
+        return self.sessions.get(message.guild.id if message.guild else None)
 
     def _update_secrets(self) -> Set[str]:
-        before: set[str] = set(self.voice_secrets)
-        self.voice_secrets = dynamodb.get_item(Key={"id": "voice_secrets"}).get("Item", {}).get("data", {})
-        if not self.voice_secrets:
+        """Reloads the voice secret catalog, and forgets decoded sounds only where it has changed.
+
+        Each secret maps a name to a Firebase path, either as a plain string or as `{"path", "version"}`, where
+        the version is changed whenever the file at that path is replaced. A decoded sound is only evicted if no
+        secret refers to its path anymore or its version changed, and mixes are only evicted if they use a
+        secret which changed. Everything else keeps its decoded buffers.
+
+        Returns:
+            Set[str]: Names of the secrets which were added.
+        """
+        catalog = dynamodb.get_item(Key={"id": "voice_secrets"}).get("Item", {}).get("data", {})
+        if not catalog:
             print("WARNING: NO VOICE SECRETS FOUND")
 
-        self.cached_voice_secrets = {}
+        stored_versions = {path: self.sound_bank.catalog_version(path) for path in list(self.sound_bank.index)}
+        update = diff_catalog(catalog, self.voice_secrets, self.secret_versions, stored_versions)
+        self.voice_secrets, self.secret_versions = update.secrets, update.versions
 
-        return set(self.voice_secrets) - before
+        for path in update.stale_paths:
+            self.cached_voice_secrets.pop(path)
+            self.cached_voice_secrets.pop(("opus", path))
+            self.sound_bank.remove(path)
 
-    async def join_in_response(self, message) -> bool:
+        for key, _ in self.cached_voice_secrets.items():
+            if isinstance(key, tuple) and key[0] == "mix" and sound_names(parse(key[1])) & update.changed:
+                self.cached_voice_secrets.pop(key)
+
+        logger.info(f"Voice secrets updated: {len(update.added)} added, {len(update.changed)} changed or removed")
+
+        return update.added
+
+    async def join_in_response(self, message) -> Optional[VoiceSession]:
         """Tries to join the voice channel of the message author.
 
         Args:
             message (discord.Message): Message object.
 
         Returns:
-            bool: True if the bot joined a voice channel.
+            Optional[VoiceSession]: The voice session of the guild, if the bot is in the author's voice channel.
         """
 
         member: Member = message.author
 
         # User not in VC
-        if member.voice is None or member.voice.channel is None:
-            return False
+        if not hasattr(member, "voice") or member.voice is None or member.voice.channel is None:
+            return None
 
         voice_channel: VocalGuildChannel = member.voice.channel
 
         # Bot needs to join VC?
-        if self.voice_client is None:
-            self.voice_client = await voice_channel.connect()
+        if (session := self.session_for(message)) is None:
+            session = await self.sessions.connect(voice_channel)
 
         # User not in the same VC as bot
-        if voice_channel != self.voice_client.channel:
-            return False
-
-        return True
-
-    def _play(self, source: AudioBufferWrapper):
-        if self.voice_client is None:
-            return
+        if voice_channel != session.channel:
+            return None
 
-        self.voice_client.stop()
-        self.voice_client.play(PCMVolumeTransformer(source, 0.5))
+        return session
 
     def _download_missing_sound_file(self, path: str) -> Path:
         """Downloads a missing sound file from firebase and returns the local
@@ -211,18 +195,23 @@ class Voice(Cog, description="Commands related to voice"):  # type: ignore
         Returns:
             str: Location of locally downloaded file.
         """
-        filename = path.split("/")[-1]
+        # Named after the whole path, since sounds are downloaded concurrently and different paths can share
+        # a basename
+        filename = f"{sha1(path.encode()).hexdigest()[:16]}-{path.split('/')[-1]}"
         location = Path("tmp") / filename
         print(f"Downloading missing file '{location}'...")
         firebase.storage().download(path, str(location))
 
         return location
 
-    def _get_audio_wrapper_from_sound_name(self, name: str) -> Optional[AudioBufferWrapper]:
+    async def _get_audio_wrapper_from_sound_name(self, name: str) -> Optional[AudioBufferWrapper]:
         """Attempts to retrieve the audio buffer for a given sound name by:
             1. Checking if it is a known voice_secret
             2. Checking if it is already cached
-            3. Downloading from Firebase and caching the buffer data
+            3. Checking if it is already being decoded, and streaming it while it is
+            4. Checking if it was decoded before, and is in the on-disk sound bank
+            5. Downloading from Firebase and streaming it while it is decoded (off the event loop) into the
+               sound bank and cache
 
         Args:
             name (str): Name of the sound to be played.
@@ -236,75 +225,268 @@ class Voice(Cog, description="Commands related to voice"):  # type: ignore
         if path is None:
             return None
 
-        if (buffer_data := self.cached_voice_secrets.get(path)) is not None:
+        if (buffer_data := self.cached_voice_secrets.get(path, np.ndarray)) is not None:
+            self._encode_opus_in_background(path, buffer_data)
             return AudioBufferWrapper(Buffer(buffer_data))
 
-        location = self._download_missing_sound_file(path)
-        audio_wrapper = AudioBufferWrapper.from_file(location)
-        self.cached_voice_secrets[path] = audio_wrapper.buffer.data.copy()
+        if (decoding := self.decoding.get(path)) is not None:
+            return AudioBufferWrapper(StreamingBuffer(decoding[0]))
+
+        try:
+            loaded = await self.sound_loads.run(path, lambda: self._load_sound(path))
+        except DecodeQueueFull:
+            logger.warning(f"Too many sounds are being decoded, dropped request for '{name}'")
+            return None
+
+        if isinstance(loaded, PCMStream):
+            return AudioBufferWrapper(StreamingBuffer(loaded))
+
+        return AudioBufferWrapper(Buffer(loaded))
+
+    async def _load_sound(self, path: str) -> Union[np.ndarray, PCMStream]:
+        """Loads a sound into the cache from the sound bank, or starts downloading and decoding it. Concurrent
+        requests for the same path should go through `self.sound_loads` so the work only happens once.
+
+        Args:
+            path (str): Firebase path.
+
+        Returns:
+            Union[np.ndarray, PCMStream]: Buffer data of the sound, or a stream which is filled as the sound
+                is decoded. The sound is added to the sound bank and cache once the stream is complete.
+        """
+        if (buffer_data := self.sound_bank.get(path)) is not None:
+            self._cache_sound(path, buffer_data)
+            return buffer_data
+
+        location = await asyncio.to_thread(self._download_missing_sound_file, path)
+        stream = PCMStream()
+        decode = self.decoder.submit(location, stream)
+        # The sound is stored against the version it was loaded at, in case the catalog changes while it decodes
+        finish = self._finish_decoding(path, self.secret_versions.get(path), location, stream, decode)
+        self.decoding[path] = (stream, asyncio.create_task(finish))
+
+        return stream
+
+    async def _finish_decoding(
+        self, path: str, version: Optional[str], location: Path, stream: PCMStream, decode: asyncio.Future
+    ):
+        try:
+            samples = await asyncio.to_thread(prepare_sound, await decode, VOICE_TARGET_DBFS, VOICE_SILENCE_DBFS)
+            # Don't keep it if it was replaced while it was decoding, so the next play loads the new version
+            if version == self.secret_versions.get(path):
+                # Hashing and writing a long sound takes a while too, so keep it off the event loop as well
+                digest = await asyncio.to_thread(content_hash, location)
+                buffer_data = await asyncio.to_thread(self.sound_bank.put, path, digest, samples, version)
+                if version == self.secret_versions.get(path):
+                    self._cache_sound(path, buffer_data)
+        except Exception:
+            logger.warning(f"Failed to decode '{path}'", exc_info=True)
+        finally:
+            stream.finish()
+            self.decoding.pop(path, None)
+
+    def _cache_sound(self, path: str, buffer_data: np.ndarray):
+        self.cached_voice_secrets.put(path, buffer_data)
+        self._encode_opus_in_background(path, buffer_data)
+
+    def _encode_opus_in_background(self, path: str, buffer_data: np.ndarray):
+        """Pre-encodes a cached sound into Opus packets at the playback volume, so playing it on its own
+        doesn't need any per-frame encoding.
+        """
+        key = ("opus", path)
+        if not VOICE_OPUS_CACHE or key in self.cached_voice_secrets or key in self.sound_loads:
+            return
+
+        async def encode():
+            packets = await asyncio.to_thread(encode_opus, buffer_data, self.sessions.volume)
+            # Skip sounds which were evicted while encoding, e.g. because the secret was replaced
+            if packets is not None and path in self.cached_voice_secrets:
+                self.cached_voice_secrets.put(key, packets)
+
+        asyncio.create_task(self.sound_loads.run(key, encode))
 
-        return audio_wrapper
+    def _opus_packets(self, name: str) -> Optional[OpusPackets]:
+        if not VOICE_OPUS_CACHE or (path := self.voice_secrets.get(name)) is None:
+            return None
+
+        # The play was already counted when its samples were looked up, so this only peeks
+        return self.cached_voice_secrets.peek(("opus", path), OpusPackets)
 
-    async def play_sound_by_file_name(self, message, requested: str, stack=False, auto_join=True):
+    async def prefetch_secrets(self, concurrency: int):
+        """Loads every voice secret into the sound bank and cache, so first plays don't wait on Firebase.
+
+        Args:
+            concurrency (int): Maximum number of sounds to load at once.
+        """
+        # Leave room in the decode queue for sounds that are actually being requested
+        semaphore = asyncio.Semaphore(max(1, min(concurrency, self.decoder.max_pending // 2)))
+
+        async def prefetch(path: str):
+            async with semaphore:
+                if path in self.cached_voice_secrets:
+                    return
+                try:
+                    await self.sound_loads.run(path, lambda: self._load_sound(path))
+                    if (decoding := self.decoding.get(path)) is not None:
+                        await asyncio.shield(decoding[1])
+                except Exception:
+                    logger.warning(f"Failed to prefetch '{path}'", exc_info=True)
+
+        paths = set(self.voice_secrets.values())
+        start = time.perf_counter()
+        await asyncio.gather(*(prefetch(path) for path in paths))
+        logger.info(f"Prefetched {len(paths)} voice secrets in {time.perf_counter() - start:.1f}s")
+
+    async def _get_sound_samples(self, name: str) -> Optional[np.ndarray]:
+        """Gets the samples of a sound by its secret name, waiting for it to finish decoding if needed."""
+        audio_wrapper = await self._get_audio_wrapper_from_sound_name(name)
+        if audio_wrapper is None:
+            return None
+
+        if isinstance(audio_wrapper.buffer, StreamingBuffer):
+            path = self.voice_secrets[name]
+            if (decoding := self.decoding.get(path)) is not None:
+                await asyncio.shield(decoding[1])
+            # Prefer the trimmed and normalized samples to what was streamed
+            if (buffer_data := self.cached_voice_secrets.get(path, np.ndarray)) is not None:
+                return buffer_data
+
+        return audio_wrapper.buffer.samples
+
+    async def play_sound_by_file_name(self, message, requested: str, stack=False, auto_join=True, queue=False):
         """Tries to play an audio file by its requested name. Allows for stacking audio
-        if prefix is included in original message (indicated by stack=True).
+        if prefix is included in original message (indicated by stack=True), or queueing it to play
+        after what is already playing (indicated by queue=True).
 
         Args:
             message (discord.Message): Message object
             requested (str): The requested sound file, by secret name.
             stack (bool, optional): Play the requested file on top of an already-playing sound. Defaults to False.
             auto_join (bool, optional): Should the bot join in response to the request. Defaults to True.
+            queue (bool, optional): Play the requested file after everything already queued. Defaults to False.
         """
-        audio_wrapper = self._get_audio_wrapper_from_sound_name(requested)
+        audio_wrapper = await self._get_audio_wrapper_from_sound_name(requested)
         if audio_wrapper is None:
             return
 
+        self.recent_players[message.author.id] = time.monotonic()
+
         # Try join VC
-        if auto_join and not await self.join_in_response(message):
-            return
-        elif not auto_join and self.voice_client is None:
+        session = await self.join_in_response(message) if auto_join else self.session_for(message)
+        if session is None:
             return
 
-        if not stack or self.voice_client is None or not self.voice_client.is_playing():
-            # New file
-            self._play(audio_wrapper)
-        elif self.client_source is not None:
-            # Combine the existing (playing) audio buffer with the buffer of the new file
-            self.client_source + audio_wrapper
+        # Sounds which are still being decoded haven't been normalized yet
+        streaming = isinstance(audio_wrapper.buffer, StreamingBuffer)
+        gain = VOICE_STREAM_VOLUME if streaming else 1.0
+        queue_full = False
+
+        with session.timings.operations.time():
+            if queue:
+                # Loaded (and decoded) now, so it is ready to start the moment the sound before it ends
+                try:
+                    session.enqueue(audio_wrapper.buffer, gain=gain, max_queued=VOICE_QUEUE_MAX)
+                except MixerQueueFull:
+                    queue_full = True
+            elif not stack or not session.is_playing() or (mixer := session.active_mixer()) is None:
+                # New file, played from its pre-encoded packets if we have them
+                packets = None if streaming else self._opus_packets(requested)
+                session.play(audio_wrapper.buffer, packets, gain=gain)
+            else:
+                # Layer the new file on top of whatever is already playing
+                mixer.add(audio_wrapper.buffer, gain=gain)
+
+        if queue_full:
+            await message.reply(f"The queue is full ({VOICE_QUEUE_MAX} sounds), try again once some have played")
 
     async def apply_audio_operation_from_message(self, message: Message):
-        """Entrypoint to filtering/adding effects to currently-playing audio.
+        """Entrypoint to filtering/adding effects to currently-playing audio, e.g. `+rev`, `+fast`,
+        `+speed 0.8`, `+vol 2`, `+echo 0.3`, `+muffle`, `+skip` or `+clear`.
 
-        Currently only supports reversing the playing audio.
+        Effects are applied to each frame as it is played, so they take effect immediately and cost
+        the same regardless of the length of the playing audio.
 
         Args:
             message (Message): The message which may contain a filter to apply.
         """
         # Not in VC, abort.
-        if self.voice_client is None:
+        if (session := self.session_for(message)) is None:
             return
 
-        op = message.content[1:]
+        name, *args = message.content[1:].lower().split() or [""]
+        try:
+            argument = float(args[0]) if args else None
+        except ValueError:
+            argument = None
+
+        with session.timings.operations.time():
+            if (mixer := session.active_mixer()) is None:
+                return
+
+            if name.startswith("rev"):
+                mixer.reverse()
+            elif name == "skip":
+                mixer.skip()
+            elif name == "clear":
+                mixer.clear_effects()
+            elif (speed := parse_speed(name, argument)) is not None:
+                mixer.set_speed(speed)
+            elif (effect := parse_effect(name, argument)) is not None:
+                mixer.add_effect(effect)
+
+    async def broadcast_attachments(self, message: Message):
+        """Plays audio files posted in a guild where the bot is in voice. Each one is played while it downloads,
+        on the guild's mixer, so it stacks with whatever else is playing.
+        """
+        if message.author.bot or message.guild is None or (session := self.sessions.get(message.guild.id)) is None:
+            return
 
-        if op.startswith("rev") and self.client_source is not None:
-            self.client_source.reverse()
+        for attachment in message.attachments:
+            if not (attachment.content_type or "").startswith("audio/"):
+                continue
+            if attachment.size > BROADCAST_MAX_BYTES:
+                await message.add_reaction("❌")
+                continue
+
+            stream = PCMStream()
+            task = asyncio.create_task(self._broadcast(message, attachment.url, stream))
+            self.broadcasts.add(task)
+            task.add_done_callback(self.broadcasts.discard)
+
+            # Posted files haven't been normalized like secrets have
+            with session.timings.operations.time():
+                if session.is_playing() and (mixer := session.active_mixer()) is not None:
+                    mixer.add(StreamingBuffer(stream), gain=VOICE_STREAM_VOLUME)
+                else:
+                    session.play(StreamingBuffer(stream), gain=VOICE_STREAM_VOLUME)
+
+    async def _broadcast(self, message: Message, url: str, stream: PCMStream):
+        if self.http is None:
+            self.http = aiohttp.ClientSession()
+
+        try:
+            await decode_url(self.http, url, stream, BROADCAST_MAX_BYTES, BROADCAST_MAX_SECONDS)
+        except DecodeLimitExceeded:
+            await message.add_reaction("❌")
+        except Exception:
+            logger.warning(f"Failed to broadcast '{url}'", exc_info=True)
 
     async def check_for_voice_secret_triggers(self, message: Message):
-        if len(message.content) == 0:
+        features = classify(message)
+        if not features.content:
             return
 
-        if secrets_disabled(message):
-            return
+        for handler in self.triggers.matching(features):
+            return await handler(message)
 
-        if message.content[0] == "&":
-            await self.play_sound_by_file_name(message, message.content[1:], stack=True)
-        elif message.content[0] == "+":
-            await self.apply_audio_operation_from_message(message)
-        else:
-            await self.play_sound_by_file_name(message, message.content)
+    @Cog.listener()
+    async def on_ready(self):
+        if VOICE_PREFETCH and self.prefetch_task is None:
+            self.prefetch_task = asyncio.create_task(self.prefetch_secrets(VOICE_PREFETCH_CONCURRENCY))
 
     @Cog.listener()
     async def on_message(self, message: Message):
+        await self.broadcast_attachments(message)
         await self.check_for_voice_secret_triggers(message)
 
     @is_owner()
@@ -333,6 +515,100 @@ class Voice(Cog, description="Commands related to voice"):  # type: ignore
 
         await sent.reply(f"Test complete, played {played} sounds")
 
+    @is_owner()
+    @command(description="Shows voice cache usage and hit/miss counts")
+    async def cache_stats(self, ctx: Context):
+        stats = self.cached_voice_secrets.stats
+
+        # Bytes and seconds of audio held in each form, to show what each form costs per second
+        usage: Dict[str, Tuple[int, float]] = {}
+        for _, value in self.cached_voice_secrets.items():
+            if isinstance(value, OpusPackets):
+                form, seconds = "Opus", len(value) * FRAME_SECONDS
+            elif isinstance(value, np.ndarray):
+                frames = dsp.as_frames(value)
+                form = "mono PCM" if frames.strides[1] == 0 else "stereo PCM"
+                seconds = frames.shape[0] / dsp.SAMPLE_RATE
+            else:
+                continue
+            total_bytes, total_seconds = usage.get(form, (0, 0.0))
+            usage[form] = (total_bytes + value.nbytes, total_seconds + seconds)
+
+        await ctx.send(
+            f"🗃️ **{stats.entries}** sounds cached ({stats.pinned} pinned), "
+            + f"{stats.resident_bytes / 1024 / 1024:.1f}/{self.cached_voice_secrets.max_bytes / 1024 / 1024:.0f} MB\n"
+            + f"Hits: {stats.hits}, misses: {stats.misses} ({stats.hit_rate:.0%} hit rate), "
+            + f"evictions: {stats.evictions}"
+            + "".join(
+                f"\n{form}: {total_bytes / 1024 / 1024:.1f} MB for {total_seconds:.0f}s "
+                + f"({total_bytes / max(total_seconds, 1e-9) / 1024:.1f} KB/s)"
+                for form, (total_bytes, total_seconds) in sorted(usage.items())
+            )
+        )
+
+    @is_owner()
+    @command(description="Shows how long connecting, playback frames and audio operations are taking in each guild")
+    async def frame_stats(self, ctx: Context):
+        if not self.sessions.timings:
+            return await ctx.send("Nothing has been played yet")
+
+        lines = []
+        for reason, connects in self.sessions.connect_timings.items():
+            p50, p99, slowest = connects.summary()
+            lines.append(
+                f"Connecting ({reason}, {connects.count} total): p50 {p50:.0f}ms, p99 {p99:.0f}ms, max {slowest:.0f}ms"
+            )
+
+        for guild_id, timings in self.sessions.timings.items():
+            guild = self.bot.get_guild(guild_id)
+            read_p50, read_p99, read_max = timings.reads.summary()
+            operation_p50, operation_p99, operation_max = timings.operations.summary()
+            lines.append(
+                f"**{guild.name if guild else guild_id}**: "
+                + f"frames p50 {read_p50:.2f}ms, p99 {read_p99:.2f}ms, max {read_max:.2f}ms, "
+                + f"{timings.reads.over_budget}/{timings.reads.count} over {FRAME_BUDGET_MS:.0f}ms\n"
+                + f"operations p50 {operation_p50:.2f}ms, p99 {operation_p99:.2f}ms, max {operation_max:.2f}ms "
+                + f"({timings.operations.count} total)"
+            )
+
+        await ctx.send("\n".join(lines))
+
+    @command(
+        description="Mixes sounds together, e.g. `!mix csgo+0.05(delay)+3(50cal)+2(1(delay)+(augh))`. "
+        + "`+` plays sounds one after another, `&` plays them on top of each other, `N(...)` repeats "
+        + "N times, and `N(delay)` waits for N seconds"
+    )
+    async def mix(self, ctx: Context, *, expression: str):
+        if secrets_disabled(ctx.message):
+            return await ctx.reply("Secrets are disabled here")
+
+        try:
+            node = parse(expression)
+        except MixError as me:
+            return await ctx.reply(f"I couldn't understand that mix: {me}")
+
+        # Rendered mixes are memoized alongside the sounds, by their normalized expression
+        key = ("mix", normalize(node))
+        rendered: Optional[np.ndarray] = self.cached_voice_secrets.get(key, np.ndarray)
+        if rendered is None:
+            names = sorted(sound_names(node))
+            samples = await asyncio.gather(*(self._get_sound_samples(name) for name in names))
+            if unknown := [f"`{name}`" for name, sound in zip(names, samples) if sound is None]:
+                return await ctx.reply(f"I don't know these sounds: {', '.join(unknown)}")
+
+            sounds = {name: sound for name, sound in zip(names, samples) if sound is not None}
+            try:
+                rendered = await asyncio.to_thread(render, node, sounds)
+            except MixError as me:
+                return await ctx.reply(str(me))
+
+            self.cached_voice_secrets.put(key, rendered)
+
+        if (session := await self.join_in_response(ctx.message)) is None:
+            return await ctx.send(Helpers.BAD_JOIN)
+
+        session.play(Buffer(rendered))
+
     @command(aliases=["j"], description="Joins a voice channel if the user is in one")
     async def join(self, ctx: Context):
         member = ctx.author
@@ -351,7 +627,7 @@ class Voice(Cog, description="Commands related to voice"):  # type: ignore
             await ctx.send(Helpers.BAD_JOIN)
             return
 
-        self.voice_client = await voice_channel.connect()
+        await self.sessions.connect(voice_channel)
 
     @command(
         aliases=["l"],
@@ -360,17 +636,11 @@ class Voice(Cog, description="Commands related to voice"):  # type: ignore
     async def leave(self, ctx: Context):
         member = ctx.author
 
-        if not hasattr(member, "guild") or not (
-            hasattr(self.voice_client, "disconnect") or hasattr(self.voice_client, "guild")
-        ):
+        if not hasattr(member, "guild"):
             return
 
-        if self.voice_client is None or self.voice_client.guild != member.guild:
+        if not await self.sessions.disconnect(member.guild.id):
             await ctx.send(Helpers.BAD_LEAVE)
-            return
-
-        await self.voice_client.disconnect()
-        self.voice_client = None
 
     @command(description="Lists the secret voice commands")
     async def secrets(self, ctx: Context):
@@ -388,18 +658,72 @@ class Voice(Cog, description="Commands related to voice"):  # type: ignore
         else:
             await ctx.send("No commands were added.")
 
-    async def leave_if_alone(self, before, after):
-        if (
-            self.voice_client is not None
-            and self.voice_client.channel in [before.channel, after.channel]
-            and len(self.voice_client.channel.members) == 1
-            and self.voice_client.channel.members[0].id == self.bot.user.id
-        ):
-            self.voice_client = await self.voice_client.disconnect()
+    def _alone(self, session: VoiceSession) -> bool:
+        me = self.bot.user
+        return all(me is not None and member.id == me.id for member in session.channel.members)
+
+    async def leave_if_alone(self, member, before, after):
+        session = self.sessions.get(member.guild.id)
+        if session is None or session.channel not in [before.channel, after.channel]:
+            return
+
+        if not self._alone(session):
+            # Someone came back before we left
+            if (task := self.idle_disconnects.pop(member.guild.id, None)) is not None:
+                task.cancel()
+            return
+
+        if not VOICE_WARM_CONNECT:
+            await self.sessions.disconnect(member.guild.id)
+        elif member.guild.id not in self.idle_disconnects:
+            # Keep the connection warm for a while, in case someone comes back to play something
+            self.idle_disconnects[member.guild.id] = asyncio.create_task(self._disconnect_when_idle(member.guild.id))
+
+    async def _disconnect_when_idle(self, guild_id: int):
+        try:
+            await asyncio.sleep(VOICE_WARM_IDLE_SECONDS)
+            if (session := self.sessions.get(guild_id)) is not None and self._alone(session):
+                await self.sessions.disconnect(guild_id)
+        finally:
+            if self.idle_disconnects.get(guild_id) is asyncio.current_task():
+                self.idle_disconnects.pop(guild_id)
+
+    def _likely_to_play(self, member: Member, channel: VocalGuildChannel) -> bool:
+        """Whether a member who just joined channel is likely to play a secret soon: they have played one
+        recently, or they are subscribed to the channel.
+        """
+        if time.monotonic() - self.recent_players.get(member.id, -VOICE_ACTIVE_SECONDS) < VOICE_ACTIVE_SECONDS:
+            return True
+
+        notifications = self.bot.get_cog("Notifications")
+        if not isinstance(notifications, Notifications):
+            return False
+
+        return str(member.id) in notifications.subscribers.get(str(channel.id), [])
+
+    async def warm_up(self, member, before, after):
+        """Connects to a voice channel ahead of time when someone likely to play a secret joins it, so the
+        first sound they play doesn't wait for the voice handshake. Only moves the bot if it is idle.
+        """
+        channel = after.channel
+        if not VOICE_WARM_CONNECT or member.bot or channel is None or channel == before.channel:
+            return
+        if channel.guild.id in DISABLE_SECRETS_FOR_GUILDS or not self._likely_to_play(member, channel):
+            return
+
+        session = self.sessions.get(channel.guild.id)
+        if session is not None and (session.channel == channel or not self._alone(session)):
+            return
+
+        try:
+            await self.sessions.connect(channel, reason="warm")
+        except Exception:
+            logger.warning(f"Failed to warm up a connection to '{channel}'", exc_info=True)
 
     @Cog.listener()
     async def on_voice_state_update(self, member, before, after):
-        await self.leave_if_alone(before, after)
+        await self.leave_if_alone(member, before, after)
+        await self.warm_up(member, before, after)
 
 
 async def setup(bot):
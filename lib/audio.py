@@ -0,0 +1,396 @@
+from collections import deque
+from dataclasses import dataclass
+from threading import Lock
+from typing import TYPE_CHECKING, Deque, List, Optional
+
+if TYPE_CHECKING:
+    from lib.effects import Effect
+
+import numpy as np
+from discord import AudioSource
+
+from lib import dsp
+from lib.timings import RollingTimings
+
+# 20ms of 48kHz stereo s16le audio, the frame size discord.py's player reads
+SAMPLE_READ_SIZE = 3840
+SAMPLE_WIDTH_BYTES = 2
+FRAME_BYTES = SAMPLE_WIDTH_BYTES * dsp.CHANNELS
+FRAMES_PER_READ = SAMPLE_READ_SIZE // FRAME_BYTES
+
+DEFAULT_MAX_VOICES = 32
+
+
+class MixerQueueFull(Exception):
+    pass
+
+
+def prepare_sound(samples: np.ndarray, target_dbfs: float = -20.0, silence_dbfs: float = -50.0) -> np.ndarray:
+    """One-time processing of a decoded sound before it is cached: trims leading and trailing silence so
+    playback starts on the first audible frame, bakes in the gain which brings it to the target loudness
+    so playback doesn't scale every frame, and stores it as mono if it is.
+    """
+    trimmed = dsp.trim_silence(samples, silence_dbfs)
+    return dsp.compact(dsp.normalize_loudness(trimmed, target_dbfs))
+
+
+class Buffer:
+    """Decoded PCM audio, stored as interleaved int16 samples or as mono (frames, 1) samples which are
+    expanded to stereo a frame at a time as they are read. The sample array is never modified, so any
+    number of Buffers (e.g. one per playing track) can share one cached sound.
+
+    Reversing only flips which end of the samples frames are read from, so it is O(1) and the
+    read position is mirrored in the same way as before (`ptr` is in bytes).
+
+    Args:
+        samples (np.ndarray): Decoded int16 samples, interleaved or mono. Trailing partial frames are ignored.
+        ptr (int): Read position, in bytes of stereo frames.
+    """
+
+    def __init__(self, samples: np.ndarray, ptr: int = 0):
+        self.samples = samples
+        self.ptr = ptr
+        self.reversed = False
+
+        self._frames = dsp.as_frames(samples)
+        self._frames.flags.writeable = False
+        self._scratch = np.zeros((FRAMES_PER_READ, dsp.CHANNELS), dtype=np.int16)
+
+    @property
+    def frames(self) -> np.ndarray:
+        """The samples as a (frames, channels) view, with mono samples broadcast to both channels."""
+        return self._frames
+
+    @property
+    def size(self) -> int:
+        return self.frames.nbytes
+
+    @property
+    def finished(self) -> bool:
+        return self.ptr >= self.size
+
+    def next_frames(self, count: int = FRAMES_PER_READ) -> np.ndarray:
+        """Returns a (frames, channels) view of the next `count` frames and advances the read position.
+        The view is shorter than `count` at the end of the buffer.
+        """
+        frames = self.frames
+        start = self.ptr // FRAME_BYTES
+        self.ptr += count * FRAME_BYTES
+
+        if not self.reversed:
+            return frames[start : start + count]
+
+        # Reading backwards from the end, without materialising the reversed buffer
+        end = frames.shape[0] - start
+        return frames[max(end - count, 0) : max(end, 0)][::-1]
+
+    def read(self) -> memoryview:
+        """The next frame as a view over the samples, without copying them where possible. The view is only
+        valid until the next read. Buffers aren't AudioSources: discord.py needs bytes, which the Mixer makes.
+        """
+        if self.finished:
+            return memoryview(b"")
+
+        frames = self.next_frames()
+        if frames.shape[0] == 0:
+            # Still waiting on a stream to be decoded, play silence in the meantime
+            self._scratch.fill(0)
+            return self._scratch.data.cast("B")
+
+        if not self.reversed and frames.flags.c_contiguous:
+            return frames.data.cast("B")
+
+        # Reversed frames are strided backwards and mono frames are broadcast, so copy them into the
+        # reusable scratch frame
+        scratch = self._scratch[: frames.shape[0]]
+        np.copyto(scratch, frames)
+        return scratch.data.cast("B")
+
+    def reverse(self):
+        self.reversed = not self.reversed
+        self.ptr += ((self.size // 2) - self.ptr) * 2
+
+
+class PCMStream:
+    """Decoded samples which are still being appended to, typically by a decoder thread, while
+    StreamingBuffers read from the part decoded so far.
+
+    Storage grows by doubling. Readers only ever see a `frames` view over whole, already-written
+    frames, and a view taken before the storage grows keeps pointing at the same (unchanged) data.
+    """
+
+    def __init__(self, capacity: int = dsp.SAMPLE_RATE * dsp.CHANNELS):
+        self.complete = False
+        self.frames = np.zeros((0, dsp.CHANNELS), dtype=np.int16)
+
+        self._storage = np.empty(max(capacity, dsp.CHANNELS), dtype=np.int16)
+        self._filled = 0
+        self._remainder = b""
+
+    @property
+    def samples(self) -> np.ndarray:
+        return self._storage[: self.frames.size]
+
+    def append(self, chunk: bytes):
+        chunk = self._remainder + chunk
+        usable = len(chunk) - len(chunk) % FRAME_BYTES
+        self._remainder = chunk[usable:]
+
+        incoming = np.frombuffer(chunk, dtype=np.int16, count=usable // SAMPLE_WIDTH_BYTES)
+        if self._filled + incoming.size > self._storage.size:
+            grown = np.empty(max(self._storage.size * 2, self._filled + incoming.size), dtype=np.int16)
+            grown[: self._filled] = self._storage[: self._filled]
+            self._storage = grown
+
+        self._storage[self._filled : self._filled + incoming.size] = incoming
+        self._filled += incoming.size
+
+        # Publish the new frames to readers
+        self.frames = self._storage[: self._filled].reshape(-1, dsp.CHANNELS)
+
+    def finish(self):
+        self.complete = True
+
+
+class StreamingBuffer(Buffer):
+    """A Buffer over a PCMStream which may still be growing. Reading forwards waits (by returning
+    no samples) until a whole frame has been decoded, instead of finishing early.
+
+    Reversing mid-decode plays backwards over what has been decoded so far, which is everything
+    before the read position. The decoded length at that moment is used to mirror `ptr` in both
+    directions, so reversing twice returns to the same place and then carries on with the stream.
+
+    Args:
+        stream (PCMStream): The stream of decoded samples.
+        ptr (int): Read position, in bytes.
+    """
+
+    def __init__(self, stream: PCMStream, ptr: int = 0):
+        self.stream = stream
+        self.ptr = ptr
+        self.reversed = False
+
+        self._snapshot = stream.frames
+        self._scratch = np.zeros((FRAMES_PER_READ, dsp.CHANNELS), dtype=np.int16)
+
+    @property
+    def samples(self) -> np.ndarray:  # type: ignore[override]
+        return self.frames.reshape(-1)
+
+    @property
+    def frames(self) -> np.ndarray:
+        return self._snapshot if self.reversed else self.stream.frames
+
+    @property
+    def finished(self) -> bool:
+        return super().finished and (self.reversed or self.stream.complete)
+
+    def next_frames(self, count: int = FRAMES_PER_READ) -> np.ndarray:
+        if not self.reversed and not self.stream.complete and self.ptr + count * FRAME_BYTES > self.size:
+            return self.frames[:0]
+
+        return super().next_frames(count)
+
+    def reverse(self):
+        if not self.reversed:
+            self._snapshot = self.stream.frames
+
+        self.ptr += ((self._snapshot.nbytes // 2) - self.ptr) * 2
+        self.reversed = not self.reversed
+
+
+@dataclass
+class Track:
+    """A single sound being played by the Mixer. Holds its own Buffer over the (shared) decoded
+    samples, so adding a track never copies the sound.
+
+    Args:
+        buffer (Buffer): The sound to play, with its own read position.
+        offset (int): Number of frames of silence to wait before the track starts.
+        gain (float): Gain for this track. Cached sounds have their level baked in, so this is only
+            needed for sounds which haven't been normalized yet, e.g. ones still being decoded.
+    """
+
+    buffer: Buffer
+    offset: int = 0
+    gain: float = 1.0
+
+    @property
+    def finished(self) -> bool:
+        return self.buffer.finished
+
+    def mix_into(self, frame: np.ndarray, speed: float = 1.0) -> int:
+        """Adds the next frame of this track on top of the samples in frame.
+
+        Args:
+            frame (np.ndarray): int32 (frames, channels) accumulator. May be the end of a frame, when the
+                track starts part way through one.
+            speed (float): Playback speed. Reads proportionally more or fewer frames from the buffer and
+                resamples them to fit the frame, which changes pitch along with speed.
+
+        Returns:
+            int: Number of frames of frame which were filled, which is less than all of them at the end of the track.
+        """
+        size = frame.shape[0]
+        if self.offset > 0:
+            self.offset -= 1
+            return size
+
+        if speed == 1.0:
+            frames = self.buffer.next_frames(size)
+            if self.gain != 1.0:
+                frames = (frames * np.float32(self.gain)).astype(np.int32)
+            frame[: frames.shape[0]] += frames
+            return frames.shape[0]
+
+        count = max(1, round(size * speed))
+        frames = self.buffer.next_frames(count)
+        if frames.shape[0] == 0:
+            return 0
+
+        # A short read at the end of the buffer fills a proportionally shorter part of the frame
+        length = min(size, max(1, round(size * frames.shape[0] / count)))
+        frame[:length] += (dsp.resize(frames, length) * np.float32(self.gain)).astype(np.int32)
+        return length
+
+    def reverse(self):
+        self.buffer.reverse()
+
+
+class Mixer(AudioSource):
+    """Plays any number of tracks on top of each other. Only the frame being read is mixed,
+    so stacking a sound costs the same regardless of how long the sounds are.
+
+    Alongside the stacked tracks is a queue of tracks played one after the other. When one queued
+    track ends part way through a frame, the next one fills the rest of it, so there are no gaps
+    between them and the same mixer (and player) keeps playing the whole queue.
+
+    Args:
+        max_voices (int): Maximum number of tracks playing at once. When a track is added past this
+            limit the oldest track is dropped, which keeps the cost of each frame bounded.
+        volume (float): Gain applied to the mixed frame. Leave this at 1.0 for normalized sounds, so mixed
+            frames are only saturated and never scaled.
+        timings (RollingTimings, optional): Records how long each frame takes to read.
+    """
+
+    def __init__(
+        self, max_voices: int = DEFAULT_MAX_VOICES, volume: float = 1.0, timings: Optional[RollingTimings] = None
+    ):
+        self.tracks: List[Track] = []
+        self.queue: Deque[Track] = deque()
+        self.effects: List["Effect"] = []
+        self.max_voices = max(1, max_voices)
+        self.volume = volume
+        self.speed = 1.0
+        self.timings = timings
+        self._frame = np.zeros((FRAMES_PER_READ, dsp.CHANNELS), dtype=np.int32)
+        self._output = np.zeros((FRAMES_PER_READ, dsp.CHANNELS), dtype=np.int16)
+        # read() is called from the player thread, everything else from the event loop
+        self._lock = Lock()
+
+    def add(self, buffer: Buffer, offset: int = 0, gain: float = 1.0) -> Track:
+        track = Track(buffer, offset=offset, gain=gain)
+        with self._lock:
+            if len(self.tracks) >= self.max_voices:
+                self.tracks = self.tracks[len(self.tracks) - self.max_voices + 1 :]
+            self.tracks.append(track)
+
+        return track
+
+    def enqueue(self, buffer: Buffer, gain: float = 1.0) -> Track:
+        """Queues a sound to play straight after everything already queued."""
+        track = Track(buffer, gain=gain)
+        with self._lock:
+            self.queue.append(track)
+
+        return track
+
+    def enqueue_if_playing(self, buffer: Buffer, gain: float = 1.0, max_queued: Optional[int] = None) -> Optional[int]:
+        """Queues a sound like enqueue(), but only if the mixer still has something to play. Once it has run out
+        the player stops reading from it, so anything queued after that would never be played.
+
+        Args:
+            buffer (Buffer): The sound to queue.
+            gain (float, optional): Gain for the sound's track.
+            max_queued (int, optional): Most sounds which can be queued, including the one playing.
+
+        Raises:
+            MixerQueueFull: If max_queued sounds are already queued.
+
+        Returns:
+            Optional[int]: How many sounds are ahead of it in the queue, or None if the mixer has run out.
+        """
+        with self._lock:
+            if not self.tracks and not self.queue:
+                return None
+            if max_queued is not None and len(self.queue) >= max_queued:
+                raise MixerQueueFull(len(self.queue))
+
+            self.queue.append(Track(buffer, gain=gain))
+            return len(self.queue) - 1
+
+    def skip(self):
+        """Stops the queued track which is playing, moving on to the next one."""
+        with self._lock:
+            if self.queue:
+                self.queue.popleft()
+
+    def reverse(self):
+        with self._lock:
+            # Only the queued track which is playing, the rest will still play forwards
+            for track in self.tracks + list(self.queue)[:1]:
+                track.reverse()
+
+    def set_speed(self, speed: float):
+        with self._lock:
+            self.speed = speed
+
+    def add_effect(self, effect: "Effect"):
+        """Adds an effect to the end of the chain run over every mixed frame."""
+        with self._lock:
+            self.effects.append(effect)
+
+    def clear_effects(self):
+        with self._lock:
+            self.effects = []
+            self.speed = 1.0
+
+    def read(self) -> bytes:
+        if self.timings is None:
+            return self._mix()
+
+        with self.timings.time():
+            return self._mix()
+
+    def _mix(self) -> bytes:
+        with self._lock:
+            if not self.tracks and not self.queue:
+                return b""
+
+            self._frame.fill(0)
+
+            filled = 0
+            while self.queue and filled < FRAMES_PER_READ:
+                filled += self.queue[0].mix_into(self._frame[filled:], self.speed)
+                if not self.queue[0].finished:
+                    break
+                self.queue.popleft()
+
+            for track in self.tracks:
+                track.mix_into(self._frame, self.speed)
+
+            self.tracks = [track for track in self.tracks if not track.finished]
+
+            frame = self._frame
+            if self.effects:
+                frame = frame.astype(np.float32)
+                for effect in self.effects:
+                    frame = effect.process(frame)
+
+            # Saturated into a preallocated frame; the only allocation is the bytes discord.py needs
+            return dsp.gain(frame, self.volume, out=self._output).tobytes()
+
+    def cleanup(self):
+        with self._lock:
+            self.tracks = []
+            self.queue.clear()
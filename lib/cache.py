@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Protocol, Tuple, Type, TypeVar
+
+
+class Resident(Protocol):
+    """Anything which knows how many bytes it keeps in memory, e.g. np.ndarray."""
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes kept in memory."""
+
+
+R = TypeVar("R", bound=Resident)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    resident_bytes: int = 0
+    entries: int = 0
+    pinned: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class SoundCache:
+    """LRU cache of decoded sounds (or anything else with `nbytes`, like pre-encoded Opus packets),
+    bounded by the total size of the cached data rather than the number of entries.
+
+    Pinned entries are never evicted. A sound is pinned automatically once it has been hit `pin_after`
+    times, as long as pinned sounds would use at most `max_pinned_bytes` of the budget.
+
+    Args:
+        max_bytes (int): Total bytes of sample data to keep resident.
+        pin_after (int, optional): Hits before a sound is pinned. 0 disables automatic pinning.
+        max_pinned_bytes (int, optional): Budget available to pinned sounds. Defaults to half of max_bytes.
+    """
+
+    def __init__(self, max_bytes: int, pin_after: int = 0, max_pinned_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.pin_after = pin_after
+        self.max_pinned_bytes = max_bytes // 2 if max_pinned_bytes is None else max_pinned_bytes
+
+        self._entries: "OrderedDict[Hashable, Resident]" = OrderedDict()
+        self._hit_counts: Dict[Hashable, int] = {}
+        self._pinned: set = set()
+        self._stats = CacheStats()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def items(self) -> List[Tuple[Hashable, Resident]]:
+        """Every cached (key, value), without counting as hits or changing the LRU order."""
+        return list(self._entries.items())
+
+    @property
+    def stats(self) -> CacheStats:
+        self._stats.entries = len(self._entries)
+        self._stats.pinned = len(self._pinned)
+        return CacheStats(**vars(self._stats))
+
+    @property
+    def pinned_bytes(self) -> int:
+        return sum(self._entries[key].nbytes for key in self._pinned)
+
+    def get(self, key: Hashable, kind: Type[R]) -> Optional[R]:
+        """The entry for key if there is one, and it is a `kind` (e.g. np.ndarray). Anything else is a miss."""
+        samples = self._entries.get(key)
+        if not isinstance(samples, kind):
+            self._stats.misses += 1
+            return None
+
+        self._stats.hits += 1
+        self._entries.move_to_end(key)
+
+        self._hit_counts[key] = self._hit_counts.get(key, 0) + 1
+        if self.pin_after and self._hit_counts[key] >= self.pin_after:
+            self.pin(key)
+
+        return samples
+
+    def peek(self, key: Hashable, kind: Type[R]) -> Optional[R]:
+        """Like get(), without counting a hit or a miss, or towards pinning. It still counts as a use for the
+        LRU order. For lookups which go along with another, counted one, so each request is only counted once.
+        """
+        samples = self._entries.get(key)
+        if not isinstance(samples, kind):
+            return None
+
+        self._entries.move_to_end(key)
+        return samples
+
+    def put(self, key: Hashable, samples: Resident):
+        # Never let a single sound flush the whole cache
+        if samples.nbytes > self.max_bytes:
+            return
+
+        self.pop(key)
+        self._entries[key] = samples
+        self._stats.resident_bytes += samples.nbytes
+        self._evict()
+
+    def pop(self, key: Hashable) -> Optional[Resident]:
+        samples = self._entries.pop(key, None)
+        self._pinned.discard(key)
+        self._hit_counts.pop(key, None)
+
+        if samples is not None:
+            self._stats.resident_bytes -= samples.nbytes
+
+        return samples
+
+    def pin(self, key: Hashable) -> bool:
+        """Pins a cached sound so it is never evicted. Returns True if the sound is pinned."""
+        if key not in self._entries:
+            return False
+
+        if key not in self._pinned:
+            if self.pinned_bytes + self._entries[key].nbytes > self.max_pinned_bytes:
+                return False
+            self._pinned.add(key)
+
+        return True
+
+    def unpin(self, key: Hashable):
+        self._pinned.discard(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._hit_counts.clear()
+        self._pinned.clear()
+        self._stats.resident_bytes = 0
+
+    def _evict(self):
+        for key in list(self._entries):
+            if self._stats.resident_bytes <= self.max_bytes:
+                break
+            if key in self._pinned:
+                continue
+
+            self.pop(key)
+            self._stats.evictions += 1
@@ -18,3 +18,27 @@ DISABLE_SECRETS_FOR_GUILDS: list[int] = config["disable_secrets_for_guilds"]
 VIDEO_GRABBER_DOMAINS: list[str] = config["video_grabber_domains"]
 SONG_TRANSLATE_DOMAINS: list[str] = config["song_translate_domains"]
 COG_EXTENSIONS: list[str] = config["cog_extensions"]
+MAX_MIXER_VOICES: int = int(config.get("max_mixer_voices", 32))
+VOICE_CACHE_MAX_BYTES: int = int(config.get("voice_cache_max_mb", 256) * 1024 * 1024)
+VOICE_CACHE_PIN_AFTER: int = int(config.get("voice_cache_pin_after", 5))
+SOUND_BANK_DIR: str = config.get("sound_bank_dir", "tmp/soundbank")
+DECODE_WORKERS: int = int(config.get("decode_workers", 2))
+DECODE_MAX_PENDING: int = int(config.get("decode_max_pending", 16))
+VOICE_PREFETCH: bool = config.get("voice_prefetch", False)
+VOICE_PREFETCH_CONCURRENCY: int = int(config.get("voice_prefetch_concurrency", 4))
+VOICE_OPUS_CACHE: bool = config.get("voice_opus_cache", True)
+VOICE_TARGET_DBFS: float = float(config.get("voice_target_dbfs", -20.0))
+VOICE_SILENCE_DBFS: float = float(config.get("voice_silence_dbfs", -50.0))
+VOICE_STREAM_VOLUME: float = float(config.get("voice_stream_volume", 0.5))
+VOICE_WARM_CONNECT: bool = config.get("voice_warm_connect", False)
+VOICE_WARM_IDLE_SECONDS: float = float(config.get("voice_warm_idle_seconds", 300))
+VOICE_ACTIVE_SECONDS: float = float(config.get("voice_active_seconds", 3600))
+VOICE_QUEUE_MAX: int = int(config.get("voice_queue_max", 20))
+BROADCAST_MAX_BYTES: int = int(config.get("broadcast_max_mb", 25) * 1024 * 1024)
+BROADCAST_MAX_SECONDS: float = float(config.get("broadcast_max_seconds", 300))
+SECRETS_RELOAD_SECONDS: float = float(config.get("secrets_reload_seconds", 0))
+VIDEO_WORKERS: int = int(config.get("video_workers", 2))
+VIDEO_JOB_TIMEOUT: float = float(config.get("video_job_timeout", 120))
+VIDEO_QUEUE_MAX: int = int(config.get("video_queue_max", 5))
+VIDEO_MAX_BYTES: int = int(config.get("video_max_mb", 8) * 1024 * 1024)
+VIDEO_PRESET: str = config.get("video_preset", "veryfast")
@@ -0,0 +1,188 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event
+from typing import Optional
+
+import aiohttp
+import ffmpeg
+import numpy as np
+
+from lib.audio import PCMStream
+from lib.dsp import CHANNELS, SAMPLE_RATE
+
+DECODE_CHUNK_SIZE = 1 << 16
+
+
+class DecodeCancelled(Exception):
+    pass
+
+
+class DecodeQueueFull(Exception):
+    pass
+
+
+class DecodeLimitExceeded(Exception):
+    pass
+
+
+def decode_file(path: Path, cancelled: Optional[Event] = None, stream: Optional[PCMStream] = None) -> np.ndarray:
+    """Decodes an audio file to 48kHz stereo int16 samples with ffmpeg.
+
+    Args:
+        path (Path): File to decode.
+        cancelled (Event, optional): When set, ffmpeg is killed and DecodeCancelled is raised.
+        stream (PCMStream, optional): Receives the samples as they are decoded, so they can be played
+            before decoding finishes. The caller is responsible for finishing the stream.
+
+    Returns:
+        np.ndarray: The decoded samples.
+    """
+    process = (
+        ffmpeg.input(str(path), guess_layout_max=0)
+        .output("pipe:", format="s16le", ar=SAMPLE_RATE, ac=CHANNELS, loglevel="quiet")
+        .run_async(pipe_stdout=True)
+    )
+
+    buffer_data = bytearray()
+    try:
+        while chunk := process.stdout.read1(DECODE_CHUNK_SIZE):
+            if cancelled is not None and cancelled.is_set():
+                raise DecodeCancelled(path)
+            if stream is not None:
+                stream.append(chunk)
+            else:
+                buffer_data += chunk
+    finally:
+        process.kill()
+        process.wait()
+
+    if stream is not None:
+        return stream.samples
+
+    return np.frombuffer(buffer_data, dtype=np.int16)
+
+
+def _pump(process, stream: PCMStream, cancelled: Event, max_samples: int):
+    """Appends ffmpeg's output to stream until it ends, is cancelled, or reaches max_samples. ffmpeg is
+    killed when it stops, so whatever is feeding it its input stops too.
+    """
+    try:
+        while chunk := process.stdout.read1(DECODE_CHUNK_SIZE):
+            if cancelled.is_set():
+                raise DecodeCancelled()
+            stream.append(chunk)
+            if stream.samples.size >= max_samples:
+                break
+    finally:
+        process.kill()
+
+
+async def decode_url(
+    session: aiohttp.ClientSession, url: str, stream: PCMStream, max_bytes: int, max_seconds: float
+) -> np.ndarray:
+    """Downloads and decodes audio at the same time, so it can be played from stream before the download
+    finishes. The download is piped straight into ffmpeg, so nothing is written to disk. Audio longer than
+    max_seconds is cut off there. The stream is finished when this returns.
+
+    Args:
+        session (aiohttp.ClientSession): Session to download with.
+        url (str): Where to download the audio from.
+        stream (PCMStream): Receives the samples as they are decoded.
+        max_bytes (int): Most bytes to download.
+        max_seconds (float): Most audio to decode.
+
+    Raises:
+        DecodeLimitExceeded: If the file is larger than max_bytes.
+
+    Returns:
+        np.ndarray: The decoded samples.
+    """
+    process = (
+        ffmpeg.input("pipe:")
+        .output("pipe:", format="s16le", ar=SAMPLE_RATE, ac=CHANNELS, loglevel="quiet")
+        .run_async(pipe_stdin=True, pipe_stdout=True)
+    )
+    cancelled = Event()
+    max_samples = int(max_seconds * SAMPLE_RATE) * CHANNELS
+    reader = asyncio.ensure_future(asyncio.to_thread(_pump, process, stream, cancelled, max_samples))
+
+    try:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            if (response.content_length or 0) > max_bytes:
+                raise DecodeLimitExceeded(url)
+
+            received = 0
+            async for chunk in response.content.iter_chunked(DECODE_CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise DecodeLimitExceeded(url)
+                # Writing blocks while ffmpeg is behind, which holds back the download too
+                await asyncio.to_thread(process.stdin.write, chunk)
+
+            await asyncio.to_thread(process.stdin.close)
+        await reader
+    except BrokenPipeError:
+        # ffmpeg stopped reading, which is fine if it was because max_seconds was reached
+        await reader
+    finally:
+        cancelled.set()
+        process.kill()
+        await asyncio.gather(reader, return_exceptions=True)
+        process.wait()
+        stream.finish()
+
+    return stream.samples
+
+
+class DecodeService:
+    """Decodes sounds on a pool of worker threads so ffmpeg never blocks the event loop.
+
+    At most `max_pending` decodes can be queued or running at once; past that, decode() raises
+    DecodeQueueFull straight away instead of letting a burst of requests pile up. Cancelling a
+    pending decode stops the ffmpeg process for that sound.
+
+    Args:
+        workers (int): Number of decoder threads.
+        max_pending (int): Maximum number of queued or running decodes.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 16):
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decoder")
+        self._cancel_events: set = set()
+
+    def submit(self, path: Path, stream: Optional[PCMStream] = None) -> "asyncio.Future[np.ndarray]":
+        """Queues a sound to be decoded, raising DecodeQueueFull if too many are already pending.
+        Cancelling the returned future stops the decode.
+        """
+        if self.pending >= self.max_pending:
+            raise DecodeQueueFull(path)
+
+        cancelled = Event()
+        self.pending += 1
+        self._cancel_events.add(cancelled)
+
+        def on_done(future: asyncio.Future):
+            if future.cancelled():
+                cancelled.set()
+            self.pending -= 1
+            self._cancel_events.discard(cancelled)
+
+        future = asyncio.get_running_loop().run_in_executor(self._executor, decode_file, path, cancelled, stream)
+        future.add_done_callback(on_done)
+
+        return future
+
+    async def decode(self, path: Path, stream: Optional[PCMStream] = None) -> np.ndarray:
+        return await self.submit(path, stream)
+
+    def cancel_all(self):
+        for cancelled in self._cancel_events:
+            cancelled.set()
+
+    def shutdown(self):
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,117 @@
+from typing import Optional
+
+import numpy as np
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+INT16_MIN = -32768
+INT16_MAX = 32767
+
+
+def as_frames(samples: np.ndarray, channels: int = CHANNELS) -> np.ndarray:
+    """(frames, channels) view of samples. Interleaved samples are reshaped (ignoring any trailing partial
+    frame), and mono (frames, 1) samples are broadcast to every channel without being copied.
+    """
+    if samples.ndim == 1:
+        return samples[: samples.size - samples.size % channels].reshape(-1, channels)
+    if samples.shape[1] == 1 and channels != 1:
+        return np.broadcast_to(samples, (samples.shape[0], channels))
+
+    return samples
+
+
+def compact(samples: np.ndarray, channels: int = CHANNELS) -> np.ndarray:
+    """Smallest lossless form of samples: (frames, 1) if every channel is identical, which halves the
+    memory of sounds which are really mono, otherwise (frames, channels).
+    """
+    frames = as_frames(samples, channels)
+    if frames.shape[1] > 1 and frames.strides[1] != 0 and (frames == frames[:, :1]).all():
+        return np.ascontiguousarray(frames[:, :1])
+
+    return frames
+
+
+def trim_silence(samples: np.ndarray, threshold_dbfs: float = -50.0, channels: int = CHANNELS) -> np.ndarray:
+    """Drops the leading and trailing frames which are quieter than threshold_dbfs on every channel.
+
+    Returns:
+        np.ndarray: (frames, channels) view of the audible part of samples, empty if none of it is audible.
+    """
+    frames = as_frames(samples, channels)
+    threshold = INT16_MAX * 10 ** (threshold_dbfs / 20)
+
+    audible = np.flatnonzero((np.abs(frames.astype(np.int32)) > threshold).any(axis=1))
+    if audible.size == 0:
+        return frames[:0]
+
+    return frames[audible[0] : audible[-1] + 1]
+
+
+def normalize_loudness(samples: np.ndarray, target_dbfs: float = -20.0, channels: int = CHANNELS) -> np.ndarray:
+    """Scales samples so their RMS level is target_dbfs, or as close as it can get without clipping.
+
+    Returns:
+        np.ndarray: New (frames, channels) int16 samples.
+    """
+    frames = as_frames(samples, channels)
+    wide = frames.astype(np.float32)
+    peak = float(np.abs(wide).max()) if wide.size else 0.0
+    if peak == 0.0:
+        return np.array(frames, dtype=np.int16)
+
+    rms = float(np.sqrt(np.mean(np.square(wide))))
+    factor = min(INT16_MAX * 10 ** (target_dbfs / 20) / rms, INT16_MAX / peak)
+
+    return saturate(np.rint(wide * np.float32(factor)))
+
+
+def saturate(samples: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Clips wide (int32/float) samples back into the int16 range.
+
+    Args:
+        samples (np.ndarray): Samples to clip.
+        out (np.ndarray, optional): int16 array of the same shape to write the result to. When given, samples
+            are clipped in place and nothing is allocated, so this is what per-frame code should use.
+    """
+    if out is None:
+        return np.clip(samples, INT16_MIN, INT16_MAX).astype(np.int16)
+
+    # Bounds of the samples' own type, or numpy takes a much slower path to compare them
+    np.clip(samples, samples.dtype.type(INT16_MIN), samples.dtype.type(INT16_MAX), out=samples)
+    np.copyto(out, samples, casting="unsafe")
+    return out
+
+
+def gain(samples: np.ndarray, factor: float, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Scales samples by factor. Also accepts a wide (e.g. int32 mix) array, saturating the result.
+    With `out`, wide samples are scaled in place and saturated into out, as in saturate().
+    """
+    if factor == 1.0:
+        return samples if samples.dtype == np.int16 else saturate(samples, out)
+    if out is None or samples.dtype == np.int16:
+        return saturate(samples * np.float32(factor))
+
+    np.multiply(samples, np.float32(factor), out=samples, casting="unsafe")
+    return saturate(samples, out)
+
+
+def reverse(samples: np.ndarray, channels: int = CHANNELS) -> np.ndarray:
+    """Reverses the order of the sample frames, keeping the channels of each frame in place."""
+    usable = samples.size - samples.size % channels
+    return np.ascontiguousarray(samples[:usable].reshape(-1, channels)[::-1]).reshape(-1)
+
+
+def resize(frames: np.ndarray, length: int) -> np.ndarray:
+    """Linearly interpolates (frames, channels) samples to exactly `length` frames, as float32."""
+    if frames.shape[0] == length:
+        return frames.astype(np.float32)
+    if frames.shape[0] < 2:
+        return np.repeat(frames.astype(np.float32), length, axis=0)[:length]
+
+    positions = np.linspace(0, frames.shape[0] - 1, length, dtype=np.float32)
+    left = positions.astype(np.int64)
+    right = np.minimum(left + 1, frames.shape[0] - 1)
+    weight = (positions - left)[:, None]
+
+    return frames[left] * (1 - weight) + frames[right] * weight
@@ -0,0 +1,113 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+from lib import dsp
+from lib.audio import FRAMES_PER_READ
+
+MIN_SPEED = 0.25
+MAX_SPEED = 4.0
+MAX_ECHO_SECONDS = 2.0
+
+
+class Effect:
+    """An effect run over every mixed frame. process() is given a float32 (frames, channels) frame and
+    returns the processed frame. Effects may keep state between frames, but their cost per frame must
+    not depend on the length of what is playing.
+    """
+
+    def process(self, frame: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class Volume(Effect):
+    def __init__(self, factor: float):
+        self.factor = np.float32(factor)
+
+    def process(self, frame: np.ndarray) -> np.ndarray:
+        return frame * self.factor
+
+
+class Echo(Effect):
+    """Feedback echo: each frame is mixed with the output from `delay` seconds earlier, scaled by
+    `feedback`. The delay is at least one frame, so each frame only depends on previous ones.
+    """
+
+    def __init__(self, delay: float = 0.25, feedback: float = 0.4):
+        self.feedback = np.float32(min(max(feedback, 0.0), 0.95))
+        length = max(FRAMES_PER_READ, int(min(delay, MAX_ECHO_SECONDS) * dsp.SAMPLE_RATE))
+
+        self._history = np.zeros((length, dsp.CHANNELS), dtype=np.float32)
+        self._position = 0
+        self._offsets = np.arange(FRAMES_PER_READ)
+
+    def process(self, frame: np.ndarray) -> np.ndarray:
+        indices = (self._position + self._offsets[: frame.shape[0]]) % self._history.shape[0]
+
+        echoed = frame + self._history[indices] * self.feedback
+        self._history[indices] = echoed
+        self._position = (self._position + frame.shape[0]) % self._history.shape[0]
+
+        return echoed
+
+
+class LowPass(Effect):
+    """Windowed-sinc FIR low-pass filter. The last few input frames are carried over so the filter is
+    continuous across frame boundaries.
+    """
+
+    def __init__(self, cutoff: float = 1000, taps: int = 63):
+        normalized = min(max(cutoff, 20), dsp.SAMPLE_RATE / 2 - 1) / dsp.SAMPLE_RATE
+        centre = np.arange(taps) - (taps - 1) / 2
+
+        kernel = np.sinc(2 * normalized * centre) * np.hamming(taps)
+        self.kernel = (kernel / kernel.sum()).astype(np.float32)
+
+        self._tail = np.zeros((taps - 1, dsp.CHANNELS), dtype=np.float32)
+
+    def process(self, frame: np.ndarray) -> np.ndarray:
+        padded = np.concatenate((self._tail, frame))
+        self._tail = padded[frame.shape[0] :]
+
+        return np.stack(
+            [np.convolve(padded[:, channel], self.kernel, mode="valid") for channel in range(dsp.CHANNELS)],
+            axis=1,
+        )
+
+
+def _valid(argument: Optional[float]) -> bool:
+    # float() accepts "nan" and "inf", which clamping lets through and which would ruin every later frame
+    return argument is None or math.isfinite(argument)
+
+
+def parse_speed(name: str, argument: Optional[float]) -> Optional[float]:
+    """Speed (and pitch) multiplier for a `+speed`, `+fast` or `+slow` operation, or None if name isn't one."""
+    presets = {"fast": 1.5, "slow": 0.75, "speed": 1.0}
+    if name not in presets or not _valid(argument):
+        return None
+
+    return min(max(argument if argument is not None else presets[name], MIN_SPEED), MAX_SPEED)
+
+
+def parse_effect(name: str, argument: Optional[float]) -> Optional[Effect]:
+    """Creates the effect for an audio operation such as `+echo` or `+vol 2`, or None if name isn't one.
+
+    Args:
+        name (str): Name of the operation.
+        argument (float, optional): Number given after the name, if any.
+    """
+    if not _valid(argument):
+        return None
+    if name in ("vol", "volume"):
+        return Volume(min(max(argument if argument is not None else 1.0, 0.0), 4.0))
+    if name == "loud":
+        return Volume(2.0)
+    if name == "quiet":
+        return Volume(0.5)
+    if name == "echo":
+        return Echo(delay=argument if argument is not None else 0.25)
+    if name in ("lowpass", "muffle"):
+        return LowPass(cutoff=argument if argument is not None else 1000)
+
+    return None
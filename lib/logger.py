@@ -2,6 +2,7 @@ import logging
 
 logger = logging.getLogger("discord")
 logger.setLevel(logging.INFO)
-handler = logging.FileHandler(filename="discord.log", encoding="utf-8", mode="w")
+# Only created once something is logged, so importing this (e.g. from the tests) leaves no empty log behind
+handler = logging.FileHandler(filename="discord.log", encoding="utf-8", mode="w", delay=True)
 handler.setFormatter(logging.Formatter("%(asctime)s:%(levelname)s:%(name)s: %(message)s"))
 logger.addHandler(handler)
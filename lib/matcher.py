@@ -0,0 +1,171 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+NO_MATCH = 1 << 62
+# Roughly how many characters the automaton walks in the time `in` rules out one text secret. Scans in C
+# get slower with longer messages too, so this is a rule of thumb rather than a measured constant
+CHARACTERS_PER_SCAN = 3
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton over a list of literal keys, which finds every key occurring in a text in a
+    single pass over the text, however many keys there are.
+
+    Each node also remembers the lowest index of any key ending there (including keys which are suffixes
+    of the node's string), so finding the first key in priority order never needs to list every match.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._first: List[int] = [NO_MATCH]
+
+        for index, key in enumerate(keys):
+            node = 0
+            for char in key:
+                if (child := self._goto[node].get(char)) is None:
+                    child = len(self._goto)
+                    self._goto[node][char] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._first.append(NO_MATCH)
+                node = child
+            self._first[node] = min(self._first[node], index)
+
+        # Breadth first, so every node's fail link is finished before its children need it
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0) if node else 0
+                self._first[child] = min(self._first[child], self._first[self._fail[child]])
+                queue.append(child)
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def first(self, text: str) -> Optional[int]:
+        """Lowest index of the keys which occur anywhere in text, or None if none of them do."""
+        goto, fail, first = self._goto, self._fail, self._first
+
+        best = first[0]
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if first[node] < best:
+                best = first[node]
+                if best == 0:
+                    break
+
+        return None if best == NO_MATCH else best
+
+
+def _combinable(pattern: str) -> bool:
+    """Whether pattern can be put in an alternation with others and still match exactly the same strings.
+    Patterns with a top-level `|`, backreferences, named or conditional groups, or global flags are kept
+    separate.
+    """
+    depth = 0
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        if char == "\\":
+            if pattern[position + 1 : position + 2].isdigit():
+                return False
+            position += 2
+            continue
+
+        if char == "[":
+            # Skip the character class, where a leading `]` (or `^]`) is a literal
+            position += 2 if pattern[position + 1 : position + 2] == "^" else 1
+            position += 1 if pattern[position : position + 1] == "]" else 0
+            while position < len(pattern) and pattern[position] != "]":
+                position += 2 if pattern[position] == "\\" else 1
+        elif char == "(":
+            if pattern.startswith(("(?P", "(?(", "(?<", "(?i", "(?m", "(?s", "(?x", "(?a", "(?u", "(?L"), position):
+                # (?<= and (?<! are just lookbehinds
+                if not pattern.startswith(("(?<=", "(?<!"), position):
+                    return False
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return False
+
+        position += 1
+
+    return True
+
+
+class SecretMatcher:
+    """Finds the response to a message from the regex and text secrets in one go. Regex secrets must match
+    the whole message, text secrets only need to appear somewhere in it.
+
+    Priority is the same as checking each secret in turn: the first regex secret which matches, otherwise
+    the first text secret which appears. Runs of regex secrets are combined into a single alternation, and
+    the text secrets into one Aho-Corasick automaton.
+
+    The automaton walks the message a character at a time in Python, while `in` scans for each text secret
+    in C, so long messages with only a few text secrets are still checked one secret at a time.
+
+    Args:
+        regex_secrets (Dict[str, Any]): Regex to response, in priority order.
+        text_secrets (Dict[str, Any]): Text to response, in priority order.
+    """
+
+    def __init__(self, regex_secrets: Dict[str, Any], text_secrets: Dict[str, Any]):
+        self._regex_runs: List[Tuple[re.Pattern, List[Tuple[re.Pattern, Any]]]] = []
+        self._text_secrets = text_secrets
+        self._text_responses = list(text_secrets.values())
+        self._text = AhoCorasick(text_secrets.keys())
+        self.size = len(regex_secrets) + len(text_secrets)
+
+        run: List[Tuple[str, re.Pattern, Any]] = []
+        for pattern, response in regex_secrets.items():
+            # Compile every pattern on its own first, so a bad one fails the same way it always has
+            compiled = re.compile(rf"^{pattern}$", flags=re.IGNORECASE)
+            if _combinable(pattern):
+                run.append((pattern, compiled, response))
+            else:
+                self._add_run(run)
+                self._regex_runs.append((compiled, [(compiled, response)]))
+                run = []
+        self._add_run(run)
+
+    def _add_run(self, run: List[Tuple[str, re.Pattern, Any]]):
+        if not run:
+            return
+
+        # No capturing groups to tell the secrets apart, as saving them for every branch costs more than
+        # checking the run's secrets one by one on the rare message which matches
+        alternation = "|".join(f"(?:{pattern})$" for pattern, _, _ in run)
+        try:
+            combined = re.compile(f"^(?:{alternation})", flags=re.IGNORECASE)
+        except re.error:
+            for _, compiled, response in run:
+                self._regex_runs.append((compiled, [(compiled, response)]))
+            return
+
+        self._regex_runs.append((combined, [(compiled, response) for _, compiled, response in run]))
+
+    def match(self, content: str) -> Optional[Any]:
+        for combined, secrets in self._regex_runs:
+            # A pattern starting with ^ is only ever tried from the start of the message, even by search
+            if combined.search(content) is not None:
+                # Something in the run matched, so find out which secret came first. Messages rarely do
+                for compiled, response in secrets:
+                    if compiled.search(content) is not None:
+                        return response
+
+        if len(content) > CHARACTERS_PER_SCAN * len(self._text_responses):
+            for text, response in self._text_secrets.items():
+                if text in content:
+                    return response
+        elif (index := self._text.first(content)) is not None:
+            return self._text_responses[index]
+
+        return None
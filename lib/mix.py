@@ -0,0 +1,234 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Set, Tuple, Union
+
+import numpy as np
+
+from lib import dsp
+
+DELAY = "delay"
+MAX_REPEATS = 50
+MAX_MIX_SECONDS = 60
+# Parsing recurses once per bracket, so deeply nested expressions would otherwise overflow the stack
+MAX_NESTING = 16
+
+TOKEN = re.compile(r"\s*(?:(?P<op>[+&()])|(?P<word>[^\s+&()]+))")
+NUMBER = re.compile(r"\d+(\.\d+)?|\.\d+")
+
+
+class MixError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Sound:
+    name: str
+
+
+@dataclass(frozen=True)
+class Delay:
+    seconds: float
+
+
+@dataclass(frozen=True)
+class Sequence:
+    """Children played one after the other."""
+
+    children: Tuple["Node", ...]
+
+
+@dataclass(frozen=True)
+class Layer:
+    """Children played on top of each other, starting together."""
+
+    children: Tuple["Node", ...]
+
+
+@dataclass(frozen=True)
+class Repeat:
+    count: int
+    child: "Node"
+
+
+Node = Union[Sound, Delay, Sequence, Layer, Repeat]
+
+
+def _tokenize(expression: str) -> List[str]:
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if match is None:
+            raise MixError(f"Unexpected character at {position}: `{expression[position:]}`")
+        tokens.append(match.group("op") or match.group("word"))
+        position = match.end()
+
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser for mix expressions:
+
+        sequence := layer ("+" layer)*
+        layer    := term ("&" term)*
+        term     := NUMBER? "(" sequence ")" | NAME
+
+    `N(...)` repeats its contents N times, except around a delay where it is the delay's length in seconds.
+    """
+
+    def __init__(self, tokens: List[str]):
+        self.tokens = tokens
+        self.position = 0
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self, expected=None) -> str:
+        token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            raise MixError(f"Expected `{expected or 'a sound'}` but found `{token or 'the end'}`")
+        self.position += 1
+        return token
+
+    def sequence(self) -> Node:
+        children = [self.layer()]
+        while self.peek() == "+":
+            self.take("+")
+            children.append(self.layer())
+
+        return children[0] if len(children) == 1 else Sequence(tuple(children))
+
+    def layer(self) -> Node:
+        children = [self.term()]
+        while self.peek() == "&":
+            self.take("&")
+            children.append(self.term())
+
+        return children[0] if len(children) == 1 else Layer(tuple(children))
+
+    def term(self) -> Node:
+        token = self.take()
+        if token in "+&)":
+            raise MixError(f"Expected a sound but found `{token}`")
+
+        count = 1.0
+        if token != "(":
+            if self.peek() != "(":
+                return Delay(1.0) if token == DELAY else Sound(token)
+            if not NUMBER.fullmatch(token):
+                raise MixError(f"`{token}` should be a number to repeat what follows it")
+            count = float(token)
+            self.take("(")
+
+        self.depth += 1
+        if self.depth > MAX_NESTING:
+            raise MixError(f"Brackets can only be nested {MAX_NESTING} deep")
+        inner = self.sequence()
+        self.take(")")
+        self.depth -= 1
+
+        if isinstance(inner, Delay):
+            return Delay(inner.seconds * count)
+        if not count.is_integer() or not 1 <= count <= MAX_REPEATS:
+            raise MixError(f"Can only repeat a sound a whole number of times, up to {MAX_REPEATS}")
+
+        return inner if count == 1 else Repeat(int(count), inner)
+
+
+def parse(expression: str) -> Node:
+    """Parses a mix expression such as `csgo+0.05(delay)+3(50cal)+2(1(delay)+(augh))` into a render graph.
+
+    `+` plays one thing after another, `&` plays things on top of each other, `N(...)` repeats
+    what is inside N times, and `N(delay)` is N seconds of silence.
+
+    Raises:
+        MixError: If the expression is malformed.
+    """
+    parser = _Parser(_tokenize(expression))
+    node = parser.sequence()
+    if parser.peek() is not None:
+        raise MixError(f"Unexpected `{parser.peek()}`")
+
+    return node
+
+
+def normalize(node: Node) -> str:
+    """Canonical text form of a parsed expression, used to memoize rendered mixes."""
+    if isinstance(node, Sound):
+        return node.name
+    if isinstance(node, Delay):
+        return f"{node.seconds:g}({DELAY})"
+    if isinstance(node, Repeat):
+        return f"{node.count}({normalize(node.child)})"
+
+    joiner = "+" if isinstance(node, Sequence) else "&"
+    return joiner.join(
+        f"({normalize(child)})" if isinstance(child, (Sequence, Layer)) else normalize(child) for child in node.children
+    )
+
+
+def sound_names(node: Node) -> Set[str]:
+    if isinstance(node, Sound):
+        return {node.name}
+    if isinstance(node, Delay):
+        return set()
+    if isinstance(node, Repeat):
+        return sound_names(node.child)
+
+    return set().union(*(sound_names(child) for child in node.children))
+
+
+def _place(node: Node, start: int, sounds: Dict[str, np.ndarray]) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yields (start frame, samples) for every sound in the graph."""
+    if isinstance(node, Sound):
+        yield start, sounds[node.name]
+    elif isinstance(node, Repeat):
+        length = duration(node.child, sounds)
+        for i in range(node.count):
+            yield from _place(node.child, start + i * length, sounds)
+    elif isinstance(node, Sequence):
+        for child in node.children:
+            yield from _place(child, start, sounds)
+            start += duration(child, sounds)
+    elif isinstance(node, Layer):
+        for child in node.children:
+            yield from _place(child, start, sounds)
+
+
+def duration(node: Node, sounds: Dict[str, np.ndarray]) -> int:
+    """Length of the rendered node, in frames."""
+    if isinstance(node, Sound):
+        return dsp.as_frames(sounds[node.name]).shape[0]
+    if isinstance(node, Delay):
+        return int(node.seconds * dsp.SAMPLE_RATE)
+    if isinstance(node, Repeat):
+        return node.count * duration(node.child, sounds)
+    if isinstance(node, Sequence):
+        return sum(duration(child, sounds) for child in node.children)
+
+    return max(duration(child, sounds) for child in node.children)
+
+
+def render(node: Node, sounds: Dict[str, np.ndarray]) -> np.ndarray:
+    """Renders a parsed expression into int16 samples in a single pass, by laying out where every
+    sound starts and adding each one into one wide accumulator.
+
+    Args:
+        node (Node): The parsed expression.
+        sounds (Dict[str, np.ndarray]): Decoded samples for every sound named in the expression, interleaved or mono.
+
+    Raises:
+        MixError: If the mix would be longer than MAX_MIX_SECONDS.
+    """
+    total = duration(node, sounds)
+    if total > MAX_MIX_SECONDS * dsp.SAMPLE_RATE:
+        raise MixError(f"Mixes can be at most {MAX_MIX_SECONDS} seconds long")
+
+    mixed = np.zeros((total, dsp.CHANNELS), dtype=np.int32)
+    for start, samples in _place(node, 0, sounds):
+        frames = dsp.as_frames(samples)
+        mixed[start : start + frames.shape[0]] += frames
+
+    return dsp.saturate(mixed).reshape(-1)
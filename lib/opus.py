@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+from threading import Lock
+from typing import List, Optional
+
+import numpy as np
+from discord import AudioSource, opus
+
+from lib import dsp
+from lib.audio import FRAMES_PER_READ, SAMPLE_READ_SIZE
+from lib.logger import logger
+from lib.timings import RollingTimings
+
+FRAME_SECONDS = FRAMES_PER_READ / dsp.SAMPLE_RATE
+
+
+@dataclass
+class OpusPackets:
+    """A sound encoded ahead of time as one Opus packet per 20ms frame, packed into one bytes object."""
+
+    data: bytes
+    offsets: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + self.offsets.nbytes
+
+    def __len__(self) -> int:
+        return self.offsets.size - 1
+
+    def __getitem__(self, index: int) -> bytes:
+        return self.data[self.offsets[index] : self.offsets[index + 1]]
+
+
+def opus_available() -> bool:
+    try:
+        return opus.is_loaded() or opus._load_default()
+    except Exception:
+        return False
+
+
+def encode_opus(samples: np.ndarray, volume: float = 1.0) -> Optional[OpusPackets]:
+    """Encodes int16 samples (interleaved or mono) into Opus packets, as discord.py would when playing them at `volume`.
+    Returns None if libopus isn't available.
+    """
+    if not opus_available():
+        logger.warning("libopus is not available, sounds won't be pre-encoded")
+        return None
+
+    encoder = opus.Encoder()
+    frames = dsp.gain(dsp.as_frames(samples), volume).reshape(-1)
+
+    # Pad the last frame with silence, Opus can only encode whole frames
+    padding = -frames.size % (SAMPLE_READ_SIZE // 2)
+    if padding:
+        frames = np.concatenate((frames, np.zeros(padding, dtype=np.int16)))
+
+    packets: List[bytes] = [
+        encoder.encode(frame.tobytes(), FRAMES_PER_READ) for frame in frames.reshape(-1, SAMPLE_READ_SIZE // 2)
+    ]
+    offsets = np.zeros(len(packets) + 1, dtype=np.int64)
+    np.cumsum([len(packet) for packet in packets], out=offsets[1:])
+
+    return OpusPackets(b"".join(packets), offsets)
+
+
+class OpusSource(AudioSource):
+    """Plays pre-encoded Opus packets, so discord.py skips encoding entirely.
+
+    Args:
+        packets (OpusPackets): The encoded sound.
+        timings (RollingTimings, optional): Records how long each frame takes to read.
+    """
+
+    def __init__(self, packets: OpusPackets, timings: Optional[RollingTimings] = None):
+        self.packets = packets
+        self.timings = timings
+        self.index = 0
+        self._lock = Lock()
+
+    @property
+    def position(self) -> int:
+        """How far playback has got, as a Buffer `ptr` into the PCM the packets were encoded from."""
+        return self.index * SAMPLE_READ_SIZE
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        if self.timings is None:
+            return self._next_packet()
+
+        with self.timings.time():
+            return self._next_packet()
+
+    def _next_packet(self) -> bytes:
+        with self._lock:
+            if self.index >= len(self.packets):
+                return b""
+
+            self.index += 1
+            return self.packets[self.index - 1]
@@ -1,29 +1,43 @@
+import asyncio
+import time
 from enum import Enum
-from glob import glob
-from os import path
-from random import choice
-from re import IGNORECASE, compile
-from string import ascii_letters
-from typing import Any, Callable, Coroutine, List, Optional, Tuple
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
 
 import isodate
 import validators
-from discord import File, Message
+from discord import DMChannel, File, Message
+from discord.abc import Snowflake
 from discord.errors import HTTPException
 from discord.ext.commands.bot import Bot
-from yt_dlp import YoutubeDL, utils
+from yt_dlp import utils
 
 from lib.api import dynamodb, spotify, youtube
-from lib.config import COMMAND_PREFIX, SPOTIFY_REDIRECT_URL, VIDEO_GRABBER_DOMAINS
+from lib.config import (
+    COMMAND_PREFIX,
+    SPOTIFY_REDIRECT_URL,
+    VIDEO_GRABBER_DOMAINS,
+    VIDEO_JOB_TIMEOUT,
+    VIDEO_QUEUE_MAX,
+    VIDEO_WORKERS,
+)
 from lib.logger import logger
-from lib.utils import secrets_disabled, try_compress_video
+from lib.matcher import SecretMatcher
+from lib.triggers import Trigger, TriggerRegistry, classify
+from lib.videos import VideoJobCancelled, VideoJobQueue, VideoQueueFull
 
-text_secrets = dynamodb.get_item(Key={"id": "text_secrets"}).get("Item", {})
 
-regex_secrets = {
-    compile(rf"^{k}$", flags=IGNORECASE): v
-    for k, v in dynamodb.get_item(Key={"id": "regex_secrets"}).get("Item", {}).items()
-}
+def load_secrets() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Fetches the (regex_secrets, text_secrets) catalogs from DynamoDB."""
+    regex = dynamodb.get_item(Key={"id": "regex_secrets"}).get("Item", {})
+    text = dynamodb.get_item(Key={"id": "text_secrets"}).get("Item", {})
+    return regex, text
+
+
+regex_secrets, text_secrets = load_secrets()
+secret_matcher = SecretMatcher(regex_secrets, text_secrets)
+video_jobs = VideoJobQueue(VIDEO_WORKERS, VIDEO_JOB_TIMEOUT, VIDEO_QUEUE_MAX)
+# One reload at a time, so a slow one can never swap in an older catalog over a newer one
+_reload_lock = asyncio.Lock()
 SPOTIFY_URL_IDENTIFIER = "open.spotify.com"
 YOUTUBE_URL_PREFIX = "https://youtu.be"
 
@@ -143,29 +157,38 @@ async def video_grabber(message: Message) -> Optional[str]:
         if not validators.url(link):
             continue
 
-        id = "jessebot_" + "".join(choice(ascii_letters) for _ in range(8))
-
-        with YoutubeDL({"outtmpl": f"tmp/{id}.%(ext)s", "f": "best[filesize<8M]"}) as ytdl:
-            try:
-                await message.add_reaction("🔃")
-                ytdl.download([link])
-                filepath = glob(f"./tmp/{id}.*")[0]
-
-                # Compress videos greater than 7.5MB so they can be set by Discord regular user
-                filepath = try_compress_video(filepath)
-
-                return path.abspath(filepath)
-            except utils.DownloadError as de:
-                logger.warn(de)
-                raise de
+        try:
+            job = video_jobs.submit(link, message.guild.id if message.guild else None, message.author.id)
+        except VideoQueueFull:
+            await message.reply("Too many videos are waiting to be grabbed here, try again once they're done")
+            return None
+        me: Optional[Snowflake] = None
+        if message.guild is not None:
+            me = message.guild.me
+        elif isinstance(message.channel, DMChannel):
+            me = message.channel.me
+
+        # Waiting for a worker, then being grabbed
+        await message.add_reaction("⏳")
+        await job.started.wait()
+        if me is not None:
+            await message.remove_reaction("⏳", me)
+        if not job.result.done():
+            await message.add_reaction("🔃")
+
+        try:
+            return await job.result
+        except VideoJobCancelled:
+            await message.add_reaction("🛑")
+            return None
+        except utils.DownloadError as de:
+            logger.warn(de)
+            raise de
 
     return None
 
 
 async def ligma(message: Message) -> Optional[str]:
-    if secrets_disabled(message):
-        return None
-
     words = message.content.split()
     if not 1 < len(words) < 8:
         return None
@@ -184,27 +207,56 @@ async def good_bot(message: Message):
 
 
 def check_text_secrets(content: str) -> Optional[str]:
-    for regex, response in regex_secrets.items():
-        if regex.search(content) is not None:
-            return response
+    return secret_matcher.match(content)
 
-    for text, response in text_secrets.items():
-        if text in content:
-            return response
 
-    return None
+async def reload_secrets(only_if_changed: bool = False) -> bool:
+    """Fetches the secret catalogs and rebuilds the matcher off the event loop, then swaps it in. Messages
+    being checked hold on to the matcher they started with, so they are never checked against half of one.
+
+    Args:
+        only_if_changed (bool, optional): Skip rebuilding if neither catalog has changed.
+
+    Returns:
+        bool: Whether a new matcher was swapped in.
+    """
+    global regex_secrets, text_secrets, secret_matcher
+
+    async with _reload_lock:
+        start = time.perf_counter()
+        regex, text = await asyncio.to_thread(load_secrets)
+        if only_if_changed and (regex, text) == (regex_secrets, text_secrets):
+            return False
+
+        matcher = await asyncio.to_thread(SecretMatcher, regex, text)
+        regex_secrets, text_secrets, secret_matcher = regex, text, matcher
+
+    logger.info(
+        f"Secrets reloaded in {(time.perf_counter() - start) * 1000:.0f}ms: "
+        + f"{len(regex)} regex and {len(text)} text secrets ({matcher.size} total)"
+    )
+    return True
+
+
+# Checked in the order they are added, and only for messages their triggers match
+text_specials: TriggerRegistry[AwaitableSpecialFunc] = TriggerRegistry()
+text_specials.add(Trigger(first_words=("whats",), min_words=2, max_words=7, secret=True), ligma)
+text_specials.add(Trigger(prefixes=("good bot",)), good_bot)
+text_specials.add(Trigger(domains=(SPOTIFY_URL_IDENTIFIER,)), spotify_youtube_converter)
+
+video_specials: TriggerRegistry[AwaitableSpecialFunc] = TriggerRegistry()
+video_specials.add(Trigger(domains=tuple(VIDEO_GRABBER_DOMAINS)), video_grabber)
 
 
 async def check_specials(content: Message) -> Optional[Tuple[str, SpecialType]]:
-    text_specials: List[AwaitableSpecialFunc] = [ligma, good_bot, spotify_youtube_converter]
-    video_specials: List[AwaitableSpecialFunc] = [video_grabber]
+    features = classify(content)
 
-    for text_special in text_specials:
+    for text_special in text_specials.matching(features):
         check = await text_special(content)
         if check is not None:
             return check, SpecialType.TEXT
 
-    for video_special in video_specials:
+    for video_special in video_specials.matching(features):
         check = await video_special(content)
         if check is not None:
             return check, SpecialType.VIDEO
@@ -0,0 +1,182 @@
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Dict, Iterator, Optional
+
+from discord.channel import VocalGuildChannel
+from discord.voice_client import VoiceClient
+
+from lib.audio import DEFAULT_MAX_VOICES, Buffer, Mixer
+from lib.opus import OpusPackets, OpusSource
+from lib.timings import FrameTimings, RollingTimings
+from lib.utils import SingleFlight
+
+
+@dataclass
+class VoiceSession:
+    """Everything the bot is doing in one guild's voice channel: the voice client, and the
+    mixer currently being played through it.
+
+    A single unmodified sound is played from its pre-encoded Opus packets when they are available,
+    which skips mixing and encoding. It is moved over to a mixer, at the same position, as soon as
+    something needs one (stacking or effects).
+    """
+
+    voice_client: VoiceClient
+    max_voices: int = DEFAULT_MAX_VOICES
+    volume: float = 1.0
+    mixer: Optional[Mixer] = None
+    opus_source: Optional[OpusSource] = None
+    opus_buffer: Optional[Buffer] = None
+    timings: FrameTimings = field(default_factory=FrameTimings)
+
+    @property
+    def guild_id(self) -> int:
+        return self.voice_client.guild.id
+
+    @property
+    def channel(self) -> VocalGuildChannel:
+        return self.voice_client.channel
+
+    def active_mixer(self) -> Optional[Mixer]:
+        """The mixer being played, switching a pre-encoded sound over to one if that is what is playing."""
+        current = self.voice_client.source
+        if current is not None and current is self.opus_source and self.opus_buffer is not None:
+            # discord.py only creates an encoder when playback starts from PCM, so the player has to be
+            # restarted on the mixer rather than having its source swapped
+            self.voice_client.stop()
+            self.opus_buffer.ptr = self.opus_source.position
+            self.mixer = Mixer(self.max_voices, volume=self.volume, timings=self.timings.reads)
+            self.mixer.enqueue(self.opus_buffer)
+            self.voice_client.play(self.mixer)
+            self.opus_source = self.opus_buffer = None
+
+        # A mixer with nothing left is about to stop, so anything added to it would never be played
+        mixer = self.mixer
+        if mixer is not None and self.voice_client.source is mixer and (mixer.tracks or mixer.queue):
+            return mixer
+
+        return None
+
+    def is_playing(self) -> bool:
+        return self.voice_client.is_playing()
+
+    def play(self, buffer: Buffer, packets: Optional[OpusPackets] = None, gain: float = 1.0):
+        """Stops whatever is playing and starts playing buffer, from its Opus packets if given or on a new mixer.
+
+        Args:
+            buffer (Buffer): The sound to play.
+            packets (OpusPackets, optional): The same sound pre-encoded at this session's volume,
+                played directly until a mixer is needed.
+            gain (float, optional): Gain for the sound's track, for sounds which haven't been normalized.
+        """
+        self.voice_client.stop()
+
+        if packets is not None:
+            self.mixer = None
+            self.opus_source, self.opus_buffer = OpusSource(packets, timings=self.timings.reads), buffer
+            self.voice_client.play(self.opus_source)
+            return
+
+        self.opus_source = self.opus_buffer = None
+        self.mixer = Mixer(self.max_voices, volume=self.volume, timings=self.timings.reads)
+        self.mixer.enqueue(buffer, gain=gain)
+        self.voice_client.play(self.mixer)
+
+    def enqueue(self, buffer: Buffer, gain: float = 1.0, max_queued: Optional[int] = None) -> int:
+        """Plays buffer straight after whatever is queued, on the mixer which is already playing, so there is
+        no gap between sounds and no new player. Starts playing it if nothing is.
+
+        Raises:
+            MixerQueueFull: If max_queued sounds are already queued.
+
+        Returns:
+            int: How many sounds are ahead of it in the queue.
+        """
+        mixer = self.active_mixer() if self.is_playing() else None
+        # Checked and queued under the mixer's lock, as the player may run out of sound at any moment
+        position = None if mixer is None else mixer.enqueue_if_playing(buffer, gain, max_queued)
+        if position is None:
+            self.play(buffer, gain=gain)
+            return 0
+
+        return position
+
+    async def disconnect(self):
+        self.voice_client.stop()
+        self.mixer = self.opus_source = self.opus_buffer = None
+        await self.voice_client.disconnect()
+
+
+class SessionManager:
+    """Keeps one VoiceSession per guild, so the bot can be in a voice channel in each guild at once.
+
+    Args:
+        max_voices (int): Maximum concurrent tracks for each session's mixer.
+        volume (float): Playback volume for each session.
+    """
+
+    def __init__(self, max_voices: int = DEFAULT_MAX_VOICES, volume: float = 1.0):
+        self.max_voices = max_voices
+        self.volume = volume
+        self._sessions: Dict[int, VoiceSession] = {}
+        # Kept per guild rather than per session, so they survive reconnecting
+        self.timings: Dict[int, FrameTimings] = {}
+        # How long connecting to a voice channel takes, by why we connected
+        self.connect_timings: Dict[str, RollingTimings] = {}
+        self._connects = SingleFlight()
+
+    def __iter__(self) -> Iterator[VoiceSession]:
+        return iter(list(self._sessions.values()))
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, guild_id: Optional[int]) -> Optional[VoiceSession]:
+        if guild_id is None:
+            return None
+
+        session = self._sessions.get(guild_id)
+        # Forget sessions where discord.py has dropped the connection from under us
+        if session is not None and not session.voice_client.is_connected():
+            self._sessions.pop(guild_id, None)
+            return None
+
+        return session
+
+    async def connect(self, channel: VocalGuildChannel, reason: str = "join") -> VoiceSession:
+        """Returns the session for the channel's guild, connecting to (or moving to) the channel if needed.
+        Concurrent connects for a guild share one connection, since discord.py refuses a second while the
+        first is still handshaking.
+
+        Args:
+            channel (VocalGuildChannel): Channel to be in.
+            reason (str, optional): Why we are connecting, e.g. "join" when a sound is waiting on the connection
+                or "warm" when connecting ahead of time. Connect latency is recorded separately for each.
+        """
+        session = await self._connects.run(channel.guild.id, partial(self._connect, channel, reason))
+        if session.channel != channel:
+            await session.voice_client.move_to(channel)
+
+        return session
+
+    async def _connect(self, channel: VocalGuildChannel, reason: str) -> VoiceSession:
+        if (session := self.get(channel.guild.id)) is not None:
+            return session
+
+        start = time.perf_counter()
+        voice_client: VoiceClient = await channel.connect()
+        self.connect_timings.setdefault(reason, RollingTimings(window=100)).record((time.perf_counter() - start) * 1000)
+        timings = self.timings.setdefault(channel.guild.id, FrameTimings())
+        session = VoiceSession(voice_client, max_voices=self.max_voices, volume=self.volume, timings=timings)
+        self._sessions[channel.guild.id] = session
+
+        return session
+
+    async def disconnect(self, guild_id: int) -> bool:
+        session = self._sessions.pop(guild_id, None)
+        if session is None:
+            return False
+
+        await session.disconnect()
+        return True
@@ -0,0 +1,214 @@
+import json
+from dataclasses import dataclass
+from hashlib import sha1
+from os import replace
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Mapping, Optional, Set
+
+import numpy as np
+
+from lib import dsp
+from lib.logger import logger
+
+INDEX_FILE = "index.json"
+# Bumped whenever the way sounds are processed before being stored changes, so older entries are rebuilt
+FORMAT_VERSION = 2
+
+
+def content_hash(path: Path) -> str:
+    digest = sha1()
+    with open(path, "rb") as fp:
+        while chunk := fp.read(1 << 20):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+@dataclass
+class CatalogUpdate:
+    """What changed between two versions of the voice secret catalog.
+
+    Attributes:
+        secrets (Dict[str, str]): Secret names to Firebase paths.
+        versions (Dict[str, Optional[str]]): Firebase paths to the version the catalog gives them, if any.
+        stale_paths (Set[str]): Paths whose decoded sounds are out of date, because no secret refers to
+            them anymore or their version changed.
+        changed (Set[str]): Names of secrets which were removed, point somewhere else, or whose sound is stale.
+        added (Set[str]): Names of secrets which are new.
+    """
+
+    secrets: Dict[str, str]
+    versions: Dict[str, Optional[str]]
+    stale_paths: Set[str]
+    changed: Set[str]
+    added: Set[str]
+
+
+def _catalog_version(version: Any) -> Optional[str]:
+    # DynamoDB gives back numeric versions as Decimal, which can't be written to the index
+    return None if version is None else str(version)
+
+
+def diff_catalog(
+    catalog: Mapping[str, Any],
+    before: Mapping[str, str],
+    before_versions: Mapping[str, Optional[str]],
+    stored_versions: Mapping[str, Optional[str]],
+) -> CatalogUpdate:
+    """Works out which decoded sounds and secrets a new voice secret catalog makes stale.
+
+    Args:
+        catalog (Mapping[str, Any]): Secret names to either a Firebase path, or `{"path", "version"}`.
+        before (Mapping[str, str]): Secret names to paths, as of the previous catalog.
+        before_versions (Mapping[str, Optional[str]]): Paths to versions, as of the previous catalog.
+        stored_versions (Mapping[str, Optional[str]]): Paths in the sound bank to the version they were stored at.
+    """
+    secrets = {name: entry["path"] if isinstance(entry, dict) else entry for name, entry in catalog.items()}
+    versions = {
+        entry["path"]: _catalog_version(entry.get("version")) for entry in catalog.values() if isinstance(entry, dict)
+    }
+    paths = set(secrets.values())
+
+    def stale(path: str, loaded_version: Optional[str]) -> bool:
+        return path not in paths or versions.get(path) != loaded_version
+
+    stale_paths = {path for path, version in stored_versions.items() if stale(path, version)}
+    stale_paths |= {path for path in before.values() if stale(path, before_versions.get(path))}
+    changed = {name for name, path in before.items() if secrets.get(name) != path or path in stale_paths}
+
+    return CatalogUpdate(secrets, versions, stale_paths, changed, set(secrets) - set(before))
+
+
+class SoundBank:
+    """On-disk store of decoded PCM, one raw int16 file per sound, so sounds survive restarts without
+    being downloaded or decoded again. Sounds are memory-mapped read-only when loaded, so their pages
+    are shared with the OS page cache instead of being copied onto the heap.
+
+    Sounds are stored with however many channels they were put with, so mono sounds take half the space.
+
+    Entries are keyed by Firebase path and the hash of the source file they were decoded from. The index
+    maps each path to its current entry, and is rewritten atomically whenever it changes. Sounds can be
+    put from worker threads; changes to the index are serialized.
+
+    Args:
+        directory (Path): Where the PCM files and index are kept.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index: Dict[str, Dict[str, Any]] = self._load_index()
+        self._lock = Lock()
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.directory / INDEX_FILE, encoding="utf-8") as fp:
+                index = json.load(fp)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning("Sound bank index is corrupt, starting from an empty bank")
+            return {}
+
+        stale = [path for path, entry in index.items() if entry.get("format") != FORMAT_VERSION]
+        for path in stale:
+            (self.directory / index.pop(path)["file"]).unlink(missing_ok=True)
+
+        # Drop entries whose PCM went missing
+        return {path: entry for path, entry in index.items() if (self.directory / entry["file"]).exists()}
+
+    def _save_index(self):
+        tmp = self.directory / f"{INDEX_FILE}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as fp:
+                json.dump(self.index, fp)
+        except Exception:
+            tmp.unlink(missing_ok=True)
+            raise
+        replace(tmp, self.directory / INDEX_FILE)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.index
+
+    def version(self, path: str) -> Optional[str]:
+        entry = self.index.get(path)
+        return entry["hash"] if entry else None
+
+    def catalog_version(self, path: str) -> Optional[str]:
+        """The version the voice secret catalog gave the sound when it was stored, if any."""
+        entry = self.index.get(path)
+        return entry.get("catalog_version") if entry else None
+
+    def get(self, path: str) -> Optional[np.ndarray]:
+        """Returns the sound's samples as (frames, channels), memory-mapped from the bank."""
+        entry = self.index.get(path)
+        if entry is None:
+            return None
+
+        channels = entry["channels"]
+        location = self.directory / entry["file"]
+        if location.stat().st_size == 0:
+            return np.zeros((0, channels), dtype=np.int16)
+
+        try:
+            return dsp.as_frames(np.memmap(location, dtype=np.int16, mode="r"), channels)
+        except OSError:
+            logger.warning(f"Could not map sound bank file '{location}'", exc_info=True)
+            self.remove(path)
+            return None
+
+    def put(
+        self, path: str, source_hash: str, samples: np.ndarray, catalog_version: Optional[str] = None
+    ) -> np.ndarray:
+        """Stores decoded samples for a Firebase path and returns them memory-mapped from the bank.
+
+        Args:
+            path (str): Firebase path of the sound.
+            source_hash (str): Hash of the file the samples were decoded from.
+            samples (np.ndarray): Decoded int16 samples, either interleaved stereo or (frames, channels).
+            catalog_version (str, optional): Version of the sound in the voice secret catalog.
+        """
+        filename = f"{sha1(path.encode()).hexdigest()[:16]}-{source_hash[:16]}.pcm"
+        location = self.directory / filename
+
+        tmp = location.with_suffix(".tmp")
+        samples.astype(np.int16, copy=False).tofile(tmp)
+        replace(tmp, location)
+
+        channels = samples.shape[1] if samples.ndim == 2 else dsp.CHANNELS
+        with self._lock:
+            previous = self.index.get(path)
+            self.index[path] = {
+                "file": filename,
+                "hash": source_hash,
+                "channels": channels,
+                "format": FORMAT_VERSION,
+                "catalog_version": _catalog_version(catalog_version),
+            }
+            try:
+                self._save_index()
+            except Exception:
+                # Don't leave an entry in memory which isn't on disk, or every later save fails with it
+                if previous is None:
+                    self.index.pop(path)
+                else:
+                    self.index[path] = previous
+                if previous is None or previous["file"] != filename:
+                    location.unlink(missing_ok=True)
+                raise
+
+        if previous and previous["file"] != filename:
+            (self.directory / previous["file"]).unlink(missing_ok=True)
+
+        mapped = self.get(path)
+        return samples if mapped is None else mapped
+
+    def remove(self, path: str):
+        with self._lock:
+            entry = self.index.pop(path, None)
+            if entry is None:
+                return
+
+            self._save_index()
+        (self.directory / entry["file"]).unlink(missing_ok=True)
@@ -0,0 +1,57 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Tuple
+
+import numpy as np
+
+# discord.py sends a frame every 20ms, so reading one has to take less than that
+FRAME_BUDGET_MS = 20.0
+DEFAULT_WINDOW = 3000
+
+
+class RollingTimings:
+    """The most recent `window` durations, in milliseconds, kept in a ring buffer so recording one is
+    O(1) and never allocates. Percentiles are computed over the window when they are asked for.
+
+    Args:
+        window (int): Number of durations to keep. 3000 frames is the last minute of playback.
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._durations = np.zeros(window, dtype=np.float32)
+        self.count = 0
+        self.over_budget = 0
+
+    def record(self, milliseconds: float):
+        self._durations[self.count % self._durations.size] = milliseconds
+        self.count += 1
+        if milliseconds > FRAME_BUDGET_MS:
+            self.over_budget += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record((time.perf_counter() - start) * 1000)
+
+    def summary(self) -> Tuple[float, float, float]:
+        """(p50, p99, max) of the durations in the window, in milliseconds."""
+        window = self._durations[: min(self.count, self._durations.size)]
+        if window.size == 0:
+            return 0.0, 0.0, 0.0
+
+        p50, p99 = np.percentile(window, [50, 99])
+        return float(p50), float(p99), float(window.max())
+
+
+@dataclass
+class FrameTimings:
+    """Timings for one guild's playback: every frame read by the player thread, and every operation
+    (stacking, reversing, effects) applied to what is playing.
+    """
+
+    reads: RollingTimings = field(default_factory=RollingTimings)
+    operations: RollingTimings = field(default_factory=RollingTimings)
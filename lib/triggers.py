@@ -0,0 +1,160 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, FrozenSet, Generic, List, Optional, Tuple, TypeVar
+
+from discord import Message
+
+from lib.utils import guild_secrets_disabled
+
+H = TypeVar("H")
+
+# Hosts are picked out with or without a scheme, so a pasted "open.spotify.com/..." still counts as a link
+_URL_HOST = re.compile(r"(?:https?://)?((?:[\w-]+\.)+[a-z]{2,})", flags=re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class MessageFeatures:
+    """Everything passive handlers decide whether to run on, worked out once per message.
+
+    Attributes:
+        content (str): The message as sent.
+        first_char (str): First character of the message, or "" if it is empty.
+        lowered (str): The message stripped and lowercased.
+        first_word (str): First word, lowercased and without apostrophes (so "What's" is "whats").
+        word_count (int): Number of whitespace separated words.
+        domains (FrozenSet[str]): Lowercased hosts of any links in the message, with or without http(s)://.
+        secrets_disabled (bool): Whether secrets are disabled where the message was sent.
+    """
+
+    content: str
+    first_char: str
+    lowered: str
+    first_word: str
+    word_count: int
+    domains: FrozenSet[str]
+    secrets_disabled: bool
+
+
+@lru_cache(maxsize=256)
+def _classify(message_id: int, content: str, guild_id: Optional[int]) -> MessageFeatures:
+    lowered = content.strip().lower()
+    words = lowered.split()
+    return MessageFeatures(
+        content=content,
+        first_char=content[:1],
+        lowered=lowered,
+        first_word=words[0].replace("'", "") if words else "",
+        word_count=len(words),
+        domains=frozenset(host.lower() for host in _URL_HOST.findall(content)),
+        secrets_disabled=guild_secrets_disabled(guild_id),
+    )
+
+
+def classify(message: Message) -> MessageFeatures:
+    """Features of message. The passive checks and every cog's on_message see the same message, so the
+    last few are remembered, by id and content so an edited message is classified again.
+    """
+    guild = getattr(message, "guild", None)
+    return _classify(message.id, message.content, guild.id if guild is not None else None)
+
+
+@dataclass(frozen=True)
+class Trigger:
+    """Cheap conditions a message has to meet for a handler to be worth running. Every condition given
+    must hold; the handler still decides for itself whether to act.
+
+    Attributes:
+        first_chars (str): The message must start with one of these characters.
+        prefixes (Tuple[str, ...]): The stripped, lowercased message must start with one of these.
+        first_words (Tuple[str, ...]): The first word (see MessageFeatures) must be one of these.
+        domains (Tuple[str, ...]): A link in the message must have one of these in its host. Anything after a
+            `/` is left for the handler to check.
+        min_words (int): Fewest words the message can have.
+        max_words (Optional[int]): Most words the message can have.
+        secret (bool): Only run where secrets are enabled.
+    """
+
+    first_chars: str = ""
+    prefixes: Tuple[str, ...] = ()
+    first_words: Tuple[str, ...] = ()
+    domains: Tuple[str, ...] = ()
+    min_words: int = 0
+    max_words: Optional[int] = None
+    secret: bool = False
+
+    def matches(self, features: MessageFeatures) -> bool:
+        if self.secret and features.secrets_disabled:
+            return False
+        if self.first_chars and (not features.first_char or features.first_char not in self.first_chars):
+            return False
+        if self.prefixes and not features.lowered.startswith(self.prefixes):
+            return False
+        if self.first_words and features.first_word not in self.first_words:
+            return False
+        if self.domains and not any(
+            domain.split("/")[0].lower() in host for domain in self.domains for host in features.domains
+        ):
+            return False
+        if features.word_count < self.min_words:
+            return False
+        if self.max_words is not None and features.word_count > self.max_words:
+            return False
+
+        return True
+
+
+class TriggerRegistry(Generic[H]):
+    """Handlers in the order they were registered, indexed by what their triggers need the message to
+    start with, or whether they need a link. Finding the handlers for a message only checks the triggers
+    which could match it, so plain chat costs a few dict lookups however many handlers there are.
+
+    Triggers with none of those conditions (or an empty prefix or word, which says nothing about how the
+    message starts) are checked for every message.
+    """
+
+    def __init__(self):
+        self._handlers: List[Tuple[Trigger, H]] = []
+        self._by_first_char: Dict[str, List[int]] = {}
+        self._by_lowered_first: Dict[str, List[int]] = {}
+        self._by_first_word: Dict[str, List[int]] = {}
+        self._by_link: List[int] = []
+        self._unindexed: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    def add(self, trigger: Trigger, handler: H) -> H:
+        index = len(self._handlers)
+        self._handlers.append((trigger, handler))
+
+        if trigger.first_chars:
+            for char in set(trigger.first_chars):
+                self._by_first_char.setdefault(char, []).append(index)
+        elif trigger.prefixes and all(trigger.prefixes):
+            for char in {prefix[:1] for prefix in trigger.prefixes}:
+                self._by_lowered_first.setdefault(char, []).append(index)
+        elif trigger.first_words and all(trigger.first_words):
+            for char in {word[:1] for word in trigger.first_words}:
+                self._by_first_word.setdefault(char, []).append(index)
+        elif trigger.domains:
+            self._by_link.append(index)
+        else:
+            self._unindexed.append(index)
+
+        return handler
+
+    def register(self, trigger: Trigger):
+        """Decorator version of add."""
+        return lambda handler: self.add(trigger, handler)
+
+    def matching(self, features: MessageFeatures) -> List[H]:
+        """Handlers whose triggers match, in the order they were registered."""
+        candidates = [
+            *self._unindexed,
+            *self._by_first_char.get(features.first_char, ()),
+            *self._by_lowered_first.get(features.lowered[:1], ()),
+            *self._by_first_word.get(features.first_word[:1], ()),
+            *(self._by_link if features.domains else ()),
+        ]
+        return [self._handlers[index][1] for index in sorted(candidates) if self._handlers[index][0].matches(features)]
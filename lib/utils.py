@@ -1,13 +1,29 @@
+import asyncio
 from glob import glob
 from os import remove, replace
+from os.path import getsize
 from posixpath import abspath
+from subprocess import TimeoutExpired
 from textwrap import wrap
+from threading import Event
 from traceback import print_exc
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
 
 import ffmpeg
 from discord import Message
 
-from lib.config import DISABLE_SECRETS_FOR_GUILDS, MAX_MESSAGE_LENGTH
+from lib.config import (
+    DISABLE_SECRETS_FOR_GUILDS,
+    MAX_MESSAGE_LENGTH,
+    VIDEO_MAX_BYTES,
+    VIDEO_PRESET,
+)
+
+T = TypeVar("T")
+
+# Fraction of the size budget kept back when picking a bitrate
+VIDEO_SIZE_MARGIN = 0.08
+MIN_VIDEO_KBPS = 100
 
 
 class Constants:
@@ -75,27 +91,86 @@ def partition_message(text: str):
     return [w.replace("%newline%", "\n") for w in wrapped]
 
 
-def try_compress_video(filepath) -> str:
-    # ffmpeg -i input.mp4 -vcodec libx264 -crf 20 output.mp4
+def video_bitrates(duration: float, max_bytes: int, has_audio: bool = True) -> Tuple[int, int]:
+    """Video and audio bitrates, in kbit/s, which fit duration seconds of video in max_bytes.
+
+    Args:
+        duration (float): Length of the video in seconds.
+        max_bytes (int): Size the video has to fit in.
+        has_audio (bool, optional): Whether to leave room for an audio track. Defaults to True.
+
+    Returns:
+        Tuple[int, int]: (video, audio) bitrates. Neither goes below what is still watchable, so very long
+            videos can still end up too large.
+    """
+    # Leave room for the container, and for single-pass encodes overshooting their bitrate a little
+    total = max_bytes * (1 - VIDEO_SIZE_MARGIN) * 8 / 1000 / max(duration, 1.0)
+    audio = (96 if total > 600 else 48) if has_audio else 0
+    return max(int(total - audio), MIN_VIDEO_KBPS), audio
+
+
+def try_compress_video(
+    filepath, max_bytes: int = VIDEO_MAX_BYTES, preset: str = VIDEO_PRESET, cancelled: Optional[Event] = None
+) -> str:
+    """Re-encodes a video so it fits in max_bytes, in a single pass at a bitrate worked out from its length.
+    Videos which already fit are left alone. Failures are printed and leave the video as it was.
+
+    Args:
+        filepath (str): The .mp4 to compress, which is replaced by the compressed video.
+        max_bytes (int, optional): Size to fit the video in. Defaults to Discord's upload limit.
+        preset (str, optional): x264 preset, trading file quality for encoding speed.
+        cancelled (Event, optional): Stops ffmpeg when set.
+
+    Returns:
+        str: Path of the video.
+    """
     output_path = f"{filepath.split('.mp4')[0]}_ffmpeg.mp4"
 
     if glob(output_path):
         return output_path
 
     try:
-        (
+        if getsize(filepath) <= max_bytes:
+            return filepath
+
+        probe = ffmpeg.probe(filepath)
+        duration = float(probe["format"]["duration"])
+        has_audio = any(stream["codec_type"] == "audio" for stream in probe["streams"])
+        video_kbps, audio_kbps = video_bitrates(duration, max_bytes, has_audio)
+
+        audio = {"acodec": "aac", "audio_bitrate": f"{audio_kbps}k"} if has_audio else {"an": None}
+        process = (
             ffmpeg.input(filepath)
             .output(
                 output_path,
                 vcodec="libx264",
-                crf="35",
-                preset="veryfast",
-                acodec="copy",
+                preset=preset,
+                video_bitrate=f"{video_kbps}k",
+                maxrate=f"{video_kbps}k",
+                bufsize=f"{video_kbps * 2}k",
                 pix_fmt="yuv420p",
+                movflags="+faststart",
                 loglevel="quiet",
+                **audio,
             )
-            .run()
+            .run_async()
         )
+        # Waited on in slices rather than all at once, so cancelling stops ffmpeg too
+        while True:
+            try:
+                process.wait(timeout=0.25)
+                break
+            except TimeoutExpired:
+                if cancelled is not None and cancelled.is_set():
+                    process.kill()
+                    process.wait()
+                    if glob(output_path):
+                        remove(output_path)
+                    return filepath
+
+        if process.returncode != 0:
+            raise ffmpeg.Error("ffmpeg", None, None)
+
         replace(output_path, filepath)
         return filepath
     except:
@@ -104,14 +179,39 @@ def try_compress_video(filepath) -> str:
 
 
 # TODO: Make per-server configurable commands
+def guild_secrets_disabled(guild_id: Optional[int]) -> bool:
+    # Secrets are disabled in DMs by default
+    return guild_id is None or guild_id in DISABLE_SECRETS_FOR_GUILDS
+
+
 def secrets_disabled(message: Message):
     if hasattr(message, "guild") and message.guild is not None:
-        return message.guild.id in DISABLE_SECRETS_FOR_GUILDS
+        return guild_secrets_disabled(message.guild.id)
 
-    # Secrets are disabled in DMs by default
-    return True
+    return guild_secrets_disabled(None)
 
 
 def cleanup_temp():
     for file in glob("./tmp/*.mp4"):
         remove(abspath(file))
+
+
+class SingleFlight:
+    """Deduplicates concurrent work by key: while a call for a key is in flight, further calls for the
+    same key await the same result instead of starting the work again.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        if (task := self._inflight.get(key)) is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # Shielded so one caller giving up doesn't cancel the work for everyone else
+        return await asyncio.shield(task)
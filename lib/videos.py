@@ -0,0 +1,275 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from glob import glob
+from multiprocessing import get_context
+from os import path, remove
+from random import choice
+from string import ascii_letters
+from typing import Any, Callable, Deque, Optional, Set, Union
+
+from yt_dlp import YoutubeDL
+
+from lib.logger import logger
+from lib.timings import RollingTimings
+from lib.utils import try_compress_video
+
+# Workers aren't forked from the bot, which has threads running (voice players, decoders) whose locks a forked
+# child could inherit held. They are forked from a server process which has already imported the bot and this
+# module instead, so each worker doesn't import (and load the config) all over again.
+_mp_context = get_context("forkserver")
+_mp_context.set_forkserver_preload(["__main__", __name__])
+
+
+class VideoJobCancelled(Exception):
+    pass
+
+
+class VideoJobTimeout(Exception):
+    pass
+
+
+class VideoQueueFull(Exception):
+    pass
+
+
+@dataclass
+class GrabbedVideo:
+    """A grabbed video, and what it took to get it under the upload limit.
+
+    Attributes:
+        path (str): Absolute path of the video.
+        downloaded_bytes (int): Size of the video as downloaded.
+        output_bytes (int): Size of the video to be sent.
+        compress_seconds (float): Wall time spent probing and transcoding.
+    """
+
+    path: str
+    downloaded_bytes: int
+    output_bytes: int
+    compress_seconds: float
+
+
+def grab_video(link: str, job_id: str, cancelled: Any) -> GrabbedVideo:
+    """Downloads a video and compresses it if needed. Runs in a worker process.
+
+    Args:
+        link (str): Link to the video.
+        job_id (str): Name for the downloaded file, in tmp/.
+        cancelled (Event): Stops the download (or compression) when set.
+
+    Raises:
+        VideoJobCancelled: If cancelled was set.
+
+    Returns:
+        GrabbedVideo: The video.
+    """
+
+    def check_cancelled(_progress):
+        if cancelled.is_set():
+            raise VideoJobCancelled(link)
+
+    with YoutubeDL(
+        {"outtmpl": f"tmp/{job_id}.%(ext)s", "f": "best[filesize<8M]", "progress_hooks": [check_cancelled]}
+    ) as ytdl:
+        ytdl.download([link])
+
+    check_cancelled(None)
+    filepath = glob(f"./tmp/{job_id}.*")[0]
+    downloaded_bytes = path.getsize(filepath)
+
+    # Compress videos too large to be sent by a regular Discord user
+    start = time.perf_counter()
+    filepath = try_compress_video(filepath, cancelled=cancelled)
+    compress_seconds = time.perf_counter() - start
+
+    return GrabbedVideo(path.abspath(filepath), downloaded_bytes, path.getsize(filepath), compress_seconds)
+
+
+@dataclass(eq=False)
+class VideoJob:
+    """A video waiting for, or being grabbed by, a worker.
+
+    Attributes:
+        user_id (Optional[int]): Who asked for the video.
+        started (asyncio.Event): Set once the job is running, or once it never will be.
+        result (asyncio.Future): The path of the grabbed video.
+    """
+
+    link: str
+    guild_id: Optional[int]
+    cancelled: Any
+    user_id: Optional[int] = None
+    id: str = field(default_factory=lambda: "jessebot_" + "".join(choice(ascii_letters) for _ in range(8)))
+    started: asyncio.Event = field(default_factory=asyncio.Event)
+    result: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    queued_at: float = field(default_factory=time.monotonic)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.started.set()
+        if not self.result.done():
+            self.result.set_exception(VideoJobCancelled(self.link))
+
+
+class VideoJobQueue:
+    """Grabs videos on a pool of worker processes, so downloading and compressing never blocks the event
+    loop. Guilds take turns: each free worker takes the oldest job of the guild which has waited longest
+    for one, so a guild posting a burst of links only holds up its own.
+
+    The pool is started with the first job, and again with the first job after shutdown(). Jobs which run
+    for longer than `timeout` are stopped.
+
+    Args:
+        workers (int): Number of worker processes, and so of videos grabbed at once.
+        timeout (float): Most seconds a job can run for.
+        max_queued (int): Most jobs each guild can have waiting, past which submit() raises VideoQueueFull.
+        grab (Callable, optional): Run in a worker process for each job, with the same arguments as (and in
+            place of) grab_video. Must be picklable, so defined at the top level of a module.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        timeout: float = 120.0,
+        max_queued: int = 5,
+        grab: Callable[[str, str, Any], GrabbedVideo] = grab_video,
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_queued = max_queued
+        self.grab = grab
+        self.peak_depth = 0
+        # How long jobs waited for a worker, how long they took once they had one, and how much of that was
+        # spent compressing
+        self.waits = RollingTimings(window=200)
+        self.durations = RollingTimings(window=200)
+        self.compressions = RollingTimings(window=200)
+        self.last_video: Optional[GrabbedVideo] = None
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager: Any = None
+        self._queues: "OrderedDict[Optional[int], Deque[VideoJob]]" = OrderedDict()
+        self._running: Set[VideoJob] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def depth(self) -> int:
+        """Jobs waiting for a worker."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def submit(self, link: str, guild_id: Optional[int], user_id: Optional[int] = None) -> VideoJob:
+        queue = self._queues.get(guild_id)
+        if queue is not None and len(queue) >= self.max_queued:
+            raise VideoQueueFull(link)
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context)
+            # Events the worker processes can see being set
+            self._manager = _mp_context.Manager()
+
+        job = VideoJob(link, guild_id, self._manager.Event(), user_id)
+        self._queues.setdefault(guild_id, deque()).append(job)
+        self.peak_depth = max(self.peak_depth, self.depth)
+        self._dispatch()
+
+        return job
+
+    def cancel(self, guild_id: Optional[int], user_id: Optional[int] = None) -> int:
+        """Cancels the waiting and running jobs for a guild, only those asked for by user_id if it is given.
+        Returns how many were cancelled, not counting any which had already been cancelled or timed out.
+        """
+        queue = self._queues.get(guild_id, deque())
+        jobs = [
+            job
+            for job in [*queue, *(job for job in self._running if job.guild_id == guild_id)]
+            if (user_id is None or job.user_id == user_id) and not job.result.done()
+        ]
+
+        # Everyone else's jobs keep their place in line
+        remaining = deque(job for job in queue if job not in jobs)
+        if remaining:
+            self._queues[guild_id] = remaining
+        else:
+            self._queues.pop(guild_id, None)
+        for job in jobs:
+            job.cancel()
+
+        return len(jobs)
+
+    def shutdown(self):
+        """Cancels every job and stops the worker processes."""
+        for guild_id in list(self._queues):
+            self.cancel(guild_id)
+        for job in self._running:
+            job.cancel()
+        for task in self._tasks:
+            task.cancel()
+        self._running.clear()
+
+        if self._pool is not None:
+            # Workers still grabbing stop at their next check for cancellation, once the manager is gone
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+            self._pool = self._manager = None
+
+    def _dispatch(self):
+        while len(self._running) < self.workers and self._queues:
+            guild_id, queue = self._queues.popitem(last=False)
+            job = queue.popleft()
+            # To the back of the line, behind every other guild waiting
+            if queue:
+                self._queues[guild_id] = queue
+
+            self._running.add(job)
+            task = asyncio.create_task(self._run(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: VideoJob):
+        self.waits.record((time.monotonic() - job.queued_at) * 1000)
+        job.started.set()
+        start = time.monotonic()
+
+        assert self._pool is not None
+        future = asyncio.wrap_future(self._pool.submit(self.grab, job.link, job.id, job.cancelled))
+        video: Union[GrabbedVideo, BaseException, None]
+        try:
+            video = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            job.cancelled.set()
+            if not job.result.done():
+                job.result.set_exception(VideoJobTimeout(job.link))
+            # The worker stops at its next check for cancellation, and only then is it free for the next job
+            video = (await asyncio.gather(future, return_exceptions=True))[0]
+        except Exception as e:
+            video = None
+            if not job.result.done():
+                job.result.set_exception(e)
+        finally:
+            self.durations.record((time.monotonic() - start) * 1000)
+            self._running.discard(job)
+            self._dispatch()
+
+        if not isinstance(video, GrabbedVideo):
+            return
+
+        self.compressions.record(video.compress_seconds * 1000)
+        self.last_video = video
+        logger.info(
+            f"Grabbed '{job.link}' in {time.monotonic() - start:.1f}s: {video.downloaded_bytes / 1024 / 1024:.1f} MB "
+            + f"downloaded, {video.output_bytes / 1024 / 1024:.1f} MB after {video.compress_seconds:.1f}s compressing"
+        )
+
+        if job.result.done():
+            # Finished after being cancelled or timing out, so nobody is waiting for the file
+            if path.exists(video.path):
+                remove(video.path)
+        else:
+            job.result.set_result(video.path)
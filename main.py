@@ -47,9 +47,7 @@ if __name__ == "__main__":
     load_bot(bot)
 
 # ==== VOICE ====
-# TODO: "broadcast": "If the bot is in a voice channel it will automatically play any sent audio files",
 # TODO: "play": "The _play_ command should be formatted as: 'play [sound]'\nUse 'list sounds' for available sounds.",
-# TODO: Allow mixing multiple sounds from message, e.g. "!mix csgo+0.05(delay)+3(50cal)+2(1(delay)+(augh))"
 
 # ==== UTILITY ====
 # TODO: "clear": "Clears the previous x messages (up to 30 if specified) in the last 100 messages: '!clear [x]'",
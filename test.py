@@ -1,6 +1,94 @@
+import asyncio
+import time
+from decimal import Decimal
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from types import SimpleNamespace
+from typing import List, Optional, cast
+
+import aiohttp
+import numpy as np
+import pytest
+from discord import Message
+
+import bench.realtime
 import cogs.text as text
 from cogs.notifications import Notifications
+from lib import dsp
+from lib.audio import (
+    FRAMES_PER_READ,
+    SAMPLE_READ_SIZE,
+    Buffer,
+    Mixer,
+    MixerQueueFull,
+    PCMStream,
+    StreamingBuffer,
+)
+from lib.cache import SoundCache
+from lib.decoder import DecodeLimitExceeded, DecodeQueueFull, DecodeService, decode_url
+from lib.effects import Echo, LowPass, Volume, parse_effect, parse_speed
+from lib.logger import handler as log_handler
+from lib.logger import logger
+from lib.matcher import SecretMatcher
+from lib.mix import MAX_NESTING, MixError, Sound, normalize, parse, render
+from lib.opus import OpusPackets
 from lib.passive import try_match_youtube_video_for_spotify_track
+from lib.sessions import SessionManager, VoiceSession
+from lib.soundbank import SoundBank, diff_catalog
+from lib.timings import RollingTimings
+from lib.triggers import Trigger, TriggerRegistry, classify
+from lib.utils import SingleFlight, video_bitrates
+from lib.videos import (
+    GrabbedVideo,
+    VideoJobCancelled,
+    VideoJobQueue,
+    VideoJobTimeout,
+    VideoQueueFull,
+)
+
+# Keep what the tests log out of the bot's log file
+logger.removeHandler(log_handler)
+
+
+class FakeVoiceClient:
+    """Stands in for discord.py's VoiceClient, which only has an encoder once it has played PCM."""
+
+    def __init__(self, guild_id: int = 1, channel=None):
+        self.guild = SimpleNamespace(id=guild_id)
+        self.channel = channel
+        self.source = None
+        self.encoder = None
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    def is_connected(self) -> bool:
+        return True
+
+    def is_playing(self) -> bool:
+        return self.source is not None
+
+    def play(self, source):
+        if not source.is_opus():
+            self.encoder = object()
+        self.source = source
+
+    def stop(self):
+        self.source = None
+
+
+def fake_grab_video(link: str, job_id: str, cancelled) -> GrabbedVideo:
+    """Stands in for grab_video in the worker processes, taking as many seconds as the link says."""
+    deadline = time.monotonic() + float(link)
+    while time.monotonic() < deadline:
+        if cancelled.is_set():
+            raise VideoJobCancelled(link)
+        time.sleep(0.01)
+
+    return GrabbedVideo(f"tmp/{job_id}.mp4", 1, 1, 0.0)
 
 
 class Tests:
@@ -24,6 +112,504 @@ class Tests:
             is not None
         )
 
+    def test_mixer_stacks_and_drops_tracks(self):
+        sound = np.full(SAMPLE_READ_SIZE, 20000, dtype=np.int16)
+
+        mixer = Mixer(max_voices=2)
+        mixer.add(Buffer(sound))
+        mixer.add(Buffer(sound))
+        mixer.add(Buffer(sound), offset=1)
+        assert len(mixer.tracks) == 2
+
+        first = np.frombuffer(mixer.read(), dtype=np.int16)
+        second = np.frombuffer(mixer.read(), dtype=np.int16)
+        assert (first == 20000).all()
+        assert (second == 32767).all()
+        assert len(mixer.tracks) == 1
+        assert len(mixer.read()) == SAMPLE_READ_SIZE
+        assert mixer.read() == b""
+
+    def test_mixer_frames_are_bytes_at_any_volume(self):
+        sound = np.full(SAMPLE_READ_SIZE * 2, -30000, dtype=np.int16)
+        mixer = Mixer(volume=0.5)
+        mixer.add(Buffer(sound))
+        mixer.add(Buffer(sound))
+
+        # discord.py's encoder only takes bytes, and each frame is its own copy of the mixed samples
+        first = mixer.read()
+        assert isinstance(first, bytes) and (np.frombuffer(first, dtype=np.int16) == -30000).all()
+        mixer.add_effect(Volume(4.0))
+        assert (np.frombuffer(mixer.read(), dtype=np.int16) == -32768).all()
+        assert (np.frombuffer(first, dtype=np.int16) == -30000).all()
+
+    def test_mixer_queue_is_gapless(self):
+        mixer = Mixer()
+        mixer.enqueue(Buffer(np.full(2000, 100, dtype=np.int16)))
+        mixer.enqueue(Buffer(np.full(3000, 7, dtype=np.int16)))
+
+        # The second sound starts on the very next frame after the first ends, part way through a read
+        played = np.concatenate([np.frombuffer(mixer.read(), dtype=np.int16) for _ in range(3)])
+        assert (played[:2000] == 100).all()
+        assert (played[2000:5000] == 7).all()
+        assert mixer.read() == b""
+
+    def test_queueing_never_drops_sounds(self):
+        session = VoiceSession(FakeVoiceClient())
+        session.play(Buffer(np.full(2000, 1, dtype=np.int16)))
+        mixer = session.mixer
+        assert session.enqueue(Buffer(np.full(2000, 2, dtype=np.int16)), max_queued=2) == 1
+        with pytest.raises(MixerQueueFull):
+            session.enqueue(Buffer(np.full(2000, 3, dtype=np.int16)), max_queued=2)
+
+        # Once the player has drained the mixer, queueing on it would never be heard, so a new one starts
+        while mixer.read():
+            pass
+        assert mixer.enqueue_if_playing(Buffer(np.zeros(2, dtype=np.int16))) is None
+        assert session.enqueue(Buffer(np.full(2000, 4, dtype=np.int16))) == 0
+        assert session.mixer is not mixer and session.voice_client.source is session.mixer
+        assert np.frombuffer(session.mixer.read(), dtype=np.int16)[0] == 4
+
+    def test_buffer_reverse_mirrors_ptr(self):
+        buffer = Buffer(np.arange(SAMPLE_READ_SIZE, dtype=np.int16))
+        first = np.frombuffer(buffer.read(), dtype=np.int16).copy()
+
+        buffer.reverse()
+        assert buffer.ptr == SAMPLE_READ_SIZE
+        assert not buffer.finished
+
+        # Reading backwards from the mirrored position replays the first frame in reverse
+        backwards = np.frombuffer(buffer.read(), dtype=np.int16).reshape(-1, 2)
+        assert (backwards[::-1].reshape(-1) == first).all()
+        assert buffer.finished
+
+    def test_streaming_buffer_waits_reverses_and_finishes(self):
+        stream = PCMStream(capacity=16)
+        buffer = StreamingBuffer(stream)
+
+        # Nothing decoded yet, so it plays silence without moving or finishing
+        assert bytes(buffer.read()) == bytes(SAMPLE_READ_SIZE)
+        assert buffer.ptr == 0 and not buffer.finished
+
+        # Chunks needn't end on a frame, and storage grows past its capacity
+        decoded = np.arange(SAMPLE_READ_SIZE, dtype=np.int16)
+        half = SAMPLE_READ_SIZE // 2
+        data = decoded[:half].tobytes()
+        stream.append(data[:1001])
+        stream.append(data[1001:])
+        first = np.frombuffer(buffer.read(), dtype=np.int16)
+        assert (first == decoded[:half]).all()
+        assert bytes(buffer.read()) == bytes(SAMPLE_READ_SIZE)
+
+        # Reversing mid-decode plays back what was decoded before the read position
+        buffer.reverse()
+        backwards = np.frombuffer(buffer.read(), dtype=np.int16).reshape(-1, 2)
+        assert (backwards[::-1].reshape(-1) == first).all()
+        assert buffer.finished
+
+        # Reversing back starts over, and carries on with the stream as the rest is decoded
+        buffer.reverse()
+        assert buffer.ptr == 0
+        stream.append(decoded[half:].tobytes())
+        assert (np.frombuffer(buffer.read(), dtype=np.int16) == first).all()
+        assert (np.frombuffer(buffer.read(), dtype=np.int16) == decoded[half:]).all()
+
+        # Only finished once the decoder says there is nothing more to come
+        assert not buffer.finished
+        stream.finish()
+        assert buffer.finished
+
+    def test_mono_sounds_are_compacted(self):
+        mono = np.repeat(np.arange(1920, dtype=np.int16), 2)
+        compacted = dsp.compact(mono)
+        assert compacted.shape == (1920, 1)
+        assert compacted.nbytes == mono.nbytes // 2
+        assert dsp.compact(np.arange(3840, dtype=np.int16)).shape == (1920, 2)
+
+        # Playback expands mono back to interleaved stereo, forwards and reversed
+        buffer = Buffer(compacted)
+        assert np.frombuffer(buffer.read(), dtype=np.int16).tobytes() == mono[:1920].tobytes()
+        buffer.reverse()
+        assert np.frombuffer(buffer.read(), dtype=np.int16).tobytes() == dsp.reverse(mono[:1920]).tobytes()
+
+    def test_trim_silence_and_normalize_loudness(self):
+        tone = np.repeat((np.sin(np.arange(4800) / 10) * 1000).astype(np.int16), 2)
+        samples = np.concatenate((np.zeros(960, dtype=np.int16), tone, np.full(480, 3, dtype=np.int16)))
+
+        trimmed = dsp.trim_silence(samples, -50.0)
+        assert trimmed[0].any() and trimmed[-1].any()
+        assert trimmed.shape[0] <= 4800
+
+        normalized = dsp.normalize_loudness(trimmed, -20.0).astype(np.float32)
+        rms = np.sqrt(np.mean(np.square(normalized)))
+        assert abs(20 * np.log10(rms / 32767) + 20.0) < 0.1
+
+    def test_dsp_kernels_handle_silence_and_odd_lengths(self):
+        silent = np.zeros(963, dtype=np.int16)
+        assert dsp.trim_silence(silent).shape == (0, 2)
+        assert (dsp.normalize_loudness(silent) == 0).all()
+        assert dsp.normalize_loudness(silent).shape == (481, 2)
+        assert dsp.compact(silent).shape == (481, 1)
+
+        # A trailing partial frame is dropped, and channels stay in place when reversed
+        odd = np.arange(7, dtype=np.int16)
+        assert dsp.reverse(odd).tolist() == [4, 5, 2, 3, 0, 1]
+        assert dsp.as_frames(odd).shape == (3, 2)
+
+        # Normalizing a loud, peaky sound stops at full scale rather than clipping
+        spike = np.zeros(2000, dtype=np.int16)
+        spike[10] = 1000
+        assert dsp.normalize_loudness(spike, -3.0).max() == 32767
+
+        frames = np.array([[0, 0], [100, -100]], dtype=np.int16)
+        assert dsp.resize(frames, 3).tolist() == [[0, 0], [50, -50], [100, -100]]
+        assert dsp.resize(frames[:1], 3).shape == (3, 2)
+        assert dsp.resize(frames, 2).dtype == np.float32
+
+    def test_echo_repeats_an_impulse_with_decay(self):
+        echo = Echo(delay=0.25, feedback=0.5)
+        impulse = np.zeros((FRAMES_PER_READ, 2), dtype=np.float32)
+        impulse[0] = 1.0
+
+        silence = np.zeros_like(impulse)
+        output = np.concatenate([echo.process(impulse)] + [echo.process(silence) for _ in range(25)])
+
+        # Repeats every 0.25s, half as loud each time, and is silent in between
+        delay = dsp.SAMPLE_RATE // 4
+        assert output[[0, delay, delay * 2], 0].tolist() == [1.0, 0.5, 0.25]
+        assert np.count_nonzero(output[:, 0]) == 3
+
+    def test_low_pass_attenuates_high_frequencies(self):
+        t = np.arange(FRAMES_PER_READ * 10) / dsp.SAMPLE_RATE
+
+        def rms_after(frequency: float) -> float:
+            low_pass = LowPass(cutoff=1000)
+            tone = np.repeat(np.sin(2 * np.pi * frequency * t)[:, None], 2, axis=1).astype(np.float32)
+            frames = [low_pass.process(frame) for frame in np.split(tone, 10)]
+            # Skip the first frame, while the filter is still filling up
+            return float(np.sqrt(np.mean(np.square(np.concatenate(frames[1:])))))
+
+        assert rms_after(200) > 0.65
+        assert rms_after(8000) < 0.01
+
+    def test_bad_effect_specs_are_rejected(self):
+        assert parse_effect("reverb", 1.0) is None
+        assert parse_speed("echo", None) is None
+        for argument in (float("nan"), float("inf"), float("-inf")):
+            assert parse_effect("vol", argument) is None
+            assert parse_effect("echo", argument) is None
+            assert parse_effect("muffle", argument) is None
+            assert parse_speed("speed", argument) is None
+
+        # Numbers out of range are clamped
+        assert parse_speed("speed", 100.0) == 4.0
+        assert parse_effect("vol", -1.0).factor == 0.0
+        assert parse_effect("echo", 60.0)._history.shape[0] == 2 * dsp.SAMPLE_RATE
+
+    def test_realtime_playback_keeps_up(self):
+        report = bench.realtime.run(seconds=2, stack_every=0.1, reverse_every=0.5)
+        # Only what was played is checked here; how long frames took depends on the machine, see bench/realtime.py
+        assert report.frames == 100
+        assert report.silent == 0
+
+    def test_rolling_timings_only_keep_the_window(self):
+        timings = RollingTimings(window=4)
+        for milliseconds in [100, 1, 2, 3, 4]:
+            timings.record(milliseconds)
+
+        assert timings.count == 5
+        assert timings.over_budget == 1
+        assert timings.summary()[2] == 4
+
+    def test_decode_url_streams_with_limits(self):
+        with TemporaryDirectory() as directory:
+            fixtures = bench.realtime.write_fixtures(Path(directory), np.random.default_rng(0))
+            handler = partial(SimpleHTTPRequestHandler, directory=directory)
+            with ThreadingHTTPServer(("127.0.0.1", 0), handler) as server:
+                Thread(target=server.serve_forever, daemon=True).start()
+                url = f"http://127.0.0.1:{server.server_address[1]}/{fixtures['tone'].name}"
+
+                async def decode(max_bytes: int, max_seconds: float):
+                    async with aiohttp.ClientSession() as session:
+                        return await decode_url(session, url, PCMStream(), max_bytes, max_seconds)
+
+                # The 2 second tone is cut off at the duration limit
+                samples = asyncio.run(decode(1 << 20, 1.0))
+                assert 48000 * 2 <= samples.size < 48000 * 4
+
+                with pytest.raises(DecodeLimitExceeded):
+                    asyncio.run(decode(1000, 1.0))
+
+                server.shutdown()
+
+    def test_decode_service_limits_pending_and_shuts_down(self):
+        with TemporaryDirectory() as directory:
+            fixtures = bench.realtime.write_fixtures(Path(directory), np.random.default_rng(0))
+            service = DecodeService(workers=1, max_pending=1)
+
+            async def main():
+                decoding = service.submit(fixtures["tone"])
+                with pytest.raises(DecodeQueueFull):
+                    service.submit(fixtures["noise"])
+                assert (await decoding).size == 48000 * 2 * 2
+                assert service.pending == 0
+
+                # Decoding into a stream fills it as it goes, and returns the same samples
+                stream = PCMStream()
+                samples = await service.decode(fixtures["voice"], stream)
+                assert samples.size == 48000 * 2 and stream.frames.shape == (48000, 2)
+
+                service.shutdown()
+                with pytest.raises(RuntimeError):
+                    service.submit(fixtures["tone"])
+
+            asyncio.run(main())
+
+    def test_sound_cache_evicts_lru_and_keeps_pinned(self):
+        sound = np.zeros(512, dtype=np.int16)  # 1KB
+        cache = SoundCache(max_bytes=3 * 1024, pin_after=2)
+
+        for key in "abc":
+            cache.put(key, sound)
+        cache.get("a", np.ndarray)
+        cache.get("a", np.ndarray)  # pinned
+        cache.get("b", np.ndarray)
+        cache.put("d", sound)
+        cache.put("e", sound)
+
+        assert "a" in cache and "c" not in cache and "b" not in cache
+        stats = cache.stats
+        assert (stats.hits, stats.misses, stats.evictions, stats.pinned) == (3, 0, 2, 1)
+        assert stats.resident_bytes == 3 * 1024
+
+        # Peeking doesn't count, but does keep the entry from being evicted next
+        assert cache.peek("d", np.ndarray) is sound and cache.peek("z", np.ndarray) is None
+        cache.put("f", sound)
+        assert "d" in cache and "e" not in cache
+        assert (cache.stats.hits, cache.stats.misses) == (3, 0)
+
+    def test_secret_matcher_keeps_priority(self):
+        matcher = SecretMatcher(
+            {"h+m+": "hmm", "(a|b)c": "ac", "(x)\\1": "xx", "lo+l": "lol"}, {"her": "her", "he": "he", "": "any"}
+        )
+        assert matcher.match("HMMM") == "hmm"
+        assert matcher.match("bc") == "ac"
+        assert matcher.match("xx") == "xx"
+        assert matcher.match("looool") == "lol"
+        assert matcher.match("hmm lol") == "any"
+        assert matcher.match("there") == "her"
+        assert SecretMatcher({}, {"her": "her", "he": "he"}).match("the") == "he"
+
+    def test_triggers_only_match_their_messages(self):
+        registry = TriggerRegistry()
+        registry.add(Trigger(first_chars="&", secret=True), "stack")
+        registry.add(Trigger(first_words=("whats",), min_words=2, max_words=7), "ligma")
+        registry.add(Trigger(prefixes=("good bot",)), "good bot")
+        registry.add(Trigger(domains=("spotify.com",)), "spotify")
+
+        def matching(content: str, guild_id: Optional[int] = -1) -> List[str]:
+            guild = None if guild_id is None else SimpleNamespace(id=guild_id)
+            message = cast(Message, SimpleNamespace(id=len(content), content=content, guild=guild))
+            return registry.matching(classify(message))
+
+        assert matching("just chatting") == []
+        assert matching("&bruh") == ["stack"]
+        assert matching("&bruh", guild_id=None) == []
+        assert matching("What's up") == ["ligma"]
+        assert matching("whats") == []
+        assert matching("  Good Bot!") == ["good bot"]
+        assert matching("https://open.spotify.com/track/1 good bot") == ["spotify"]
+        assert matching("open.spotify.com/track/1") == ["spotify"]
+        assert matching("listen to open.spotify.com") == ["spotify"]
+        assert matching("spotify is good. com") == []
+
+    def test_video_bitrates_fit_the_size(self):
+        for duration in [5, 60, 300]:
+            video_kbps, audio_kbps = video_bitrates(duration, 8 * 1024 * 1024)
+            assert (video_kbps + audio_kbps) * 1000 / 8 * duration < 8 * 1024 * 1024
+        assert video_bitrates(60, 8 * 1024 * 1024, has_audio=False)[1] == 0
+        assert video_bitrates(3600, 8 * 1024 * 1024)[0] == 100
+
+    def test_sound_bank_round_trip(self):
+        stereo = np.arange(3840, dtype=np.int16)
+        mono = np.arange(960, dtype=np.int16)[:, None]
+        with TemporaryDirectory() as directory:
+            bank = SoundBank(Path(directory))
+            assert (bank.put("a.mp3", "hash-a", stereo, catalog_version="1") == dsp.as_frames(stereo)).all()
+            bank.put("b.mp3", "hash-b", mono)
+            assert isinstance(bank.get("a.mp3"), np.memmap)
+
+            # A new bank over the same directory sees the same sounds
+            reloaded = SoundBank(Path(directory))
+            assert (reloaded.get("a.mp3") == dsp.as_frames(stereo)).all()
+            assert reloaded.get("b.mp3").shape == (960, 1)
+            assert reloaded.version("a.mp3") == "hash-a"
+            assert reloaded.catalog_version("a.mp3") == "1"
+
+            # Replacing a sound removes the old file, removing it leaves nothing behind
+            reloaded.put("a.mp3", "hash-c", stereo)
+            reloaded.remove("b.mp3")
+            assert sorted(path.name for path in Path(directory).glob("*.pcm")) == [reloaded.index["a.mp3"]["file"]]
+            assert "b.mp3" not in SoundBank(Path(directory))
+
+    def test_catalog_refresh_only_evicts_what_changed(self):
+        before = {"kept": "kept.mp3", "bumped": "bumped.mp3", "gone": "gone.mp3", "plain": "plain.mp3"}
+        before_versions = {"kept.mp3": "1", "bumped.mp3": "1", "gone.mp3": "1"}
+        # Numbers come back from DynamoDB as Decimal
+        catalog = {
+            "kept": {"path": "kept.mp3", "version": Decimal(1)},
+            "bumped": {"path": "bumped.mp3", "version": Decimal(2)},
+            "plain": "plain.mp3",
+            "new": "new.mp3",
+        }
+
+        update = diff_catalog(catalog, before, before_versions, {"kept.mp3": "1", "bumped.mp3": "1"})
+        assert update.versions == {"kept.mp3": "1", "bumped.mp3": "2"}
+        assert update.stale_paths == {"bumped.mp3", "gone.mp3"}
+        assert update.changed == {"bumped", "gone"}
+        assert update.added == {"new"}
+
+        with TemporaryDirectory() as directory:
+            bank = SoundBank(Path(directory))
+            bank.put("bumped.mp3", "hash", np.zeros(4, dtype=np.int16), Decimal(2))
+            assert SoundBank(Path(directory)).catalog_version("bumped.mp3") == "2"
+
+    def test_single_flight_dedupes_and_survives_cancelled_callers(self):
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "sound"
+
+        async def main():
+            flight = SingleFlight()
+            assert await asyncio.gather(*(flight.run("a", load) for _ in range(5))) == ["sound"] * 5
+            assert len(calls) == 1 and "a" not in flight
+
+            # One caller giving up doesn't cancel the load for the others
+            impatient = asyncio.ensure_future(flight.run("b", load))
+            patient = asyncio.ensure_future(flight.run("b", load))
+            await asyncio.sleep(0)
+            impatient.cancel()
+            assert await patient == "sound"
+            assert len(calls) == 2
+
+        asyncio.run(main())
+
+    def test_opus_playback_moves_to_a_mixer_with_an_encoder(self):
+        voice_client = FakeVoiceClient()
+        session = VoiceSession(voice_client)
+        sound = Buffer(np.arange(SAMPLE_READ_SIZE * 3, dtype=np.int16))
+        session.play(sound, OpusPackets(b"abc", np.arange(4)))
+        voice_client.source.read()
+        assert voice_client.encoder is None
+
+        # Switching to a mixer restarts playback on it, so there is an encoder, at the same position
+        mixer = session.active_mixer()
+        assert mixer is not None and voice_client.source is mixer
+        assert voice_client.encoder is not None
+        assert sound.ptr == SAMPLE_READ_SIZE
+        assert session.opus_source is None
+
+    def test_concurrent_connects_share_one_connection(self):
+        connects = []
+
+        class Channel:
+            guild = SimpleNamespace(id=1)
+
+            async def connect(self):
+                connects.append(self)
+                await asyncio.sleep(0.01)
+                return FakeVoiceClient(channel=self)
+
+        async def main():
+            sessions = SessionManager()
+            first, other = Channel(), Channel()
+            warm, join = await asyncio.gather(sessions.connect(first, "warm"), sessions.connect(first))
+            assert warm is join and len(connects) == 1
+
+            # Joining another channel in the guild moves the session there
+            assert (await sessions.connect(other)) is warm and warm.channel is other
+            assert len(connects) == 1 and len(sessions) == 1
+
+        asyncio.run(main())
+
+    def test_video_jobs_take_turns_by_guild(self):
+        async def main():
+            jobs = VideoJobQueue(workers=1, timeout=10, max_queued=3, grab=fake_grab_video)
+            started = []
+
+            async def track(name: str, job):
+                await job.started.wait()
+                started.append(name)
+                await job.result
+
+            try:
+                burst = [jobs.submit("0.05", guild_id=1) for _ in range(4)]
+                with pytest.raises(VideoQueueFull):
+                    jobs.submit("0.05", guild_id=1)
+                other = jobs.submit("0.05", guild_id=2)
+
+                # The other guild goes next after the burst's oldest waiting job, rather than after all of them
+                await asyncio.gather(*(track(f"a{i}", job) for i, job in enumerate(burst)), track("b", other))
+                assert started == ["a0", "a1", "b", "a2", "a3"]
+                assert await other.result == f"tmp/{other.id}.mp4"
+            finally:
+                jobs.shutdown()
+
+        asyncio.run(main())
+
+    def test_video_jobs_time_out_cancel_and_restart(self):
+        async def main():
+            jobs = VideoJobQueue(workers=1, timeout=0.2, max_queued=5, grab=fake_grab_video)
+            try:
+                with pytest.raises(VideoJobTimeout):
+                    await jobs.submit("30", guild_id=1).result
+
+                running = jobs.submit("30", guild_id=1, user_id=10)
+                waiting, theirs = jobs.submit("30", guild_id=1, user_id=10), jobs.submit("30", guild_id=1, user_id=20)
+                await running.started.wait()
+
+                # Users can only cancel their own videos, unless they cancel everyone's
+                assert jobs.cancel(1, user_id=10) == 2
+                for job in (running, waiting):
+                    with pytest.raises(VideoJobCancelled):
+                        await job.result
+                assert not theirs.result.done()
+                assert jobs.cancel(1) == 1
+                with pytest.raises(VideoJobCancelled):
+                    await theirs.result
+
+                # Shutting down cancels everything, and the next job starts a new pool
+                stuck = jobs.submit("30", guild_id=2)
+                jobs.shutdown()
+                with pytest.raises(VideoJobCancelled):
+                    await stuck.result
+                jobs.timeout = 10
+                assert (await jobs.submit("0", guild_id=2).result).endswith(".mp4")
+            finally:
+                jobs.shutdown()
+
+        asyncio.run(main())
+
+    def test_mix_expression(self):
+        node = parse("csgo + 0.05(delay) + 3(50cal) + 2(1(delay)+(augh))")
+        assert normalize(node) == "csgo+0.05(delay)+3(50cal)+2(1(delay)+augh)"
+        assert normalize(parse("1(csgo)&(augh)")) == "csgo&augh"
+
+        sound = np.full(960, 1000, dtype=np.int16)  # 10ms
+        rendered = render(parse("a&a+0.01(delay)+2(a)"), {"a": sound}).reshape(-1, 2)
+        assert rendered.shape[0] == 480 * 4
+        assert (rendered[:480] == 2000).all()
+        assert (rendered[480:960] == 0).all()
+        assert (rendered[960:] == 1000).all()
+
+        # Nesting fits in the stack, however long a message can be
+        assert parse("(" * MAX_NESTING + "a" + ")" * MAX_NESTING) == Sound("a")
+        for expression in ("(" * 400 + "a" + ")" * 400, "a+", "2.5(a)", "a)"):
+            with pytest.raises(MixError):
+                parse(expression)
+
     # @pytest.mark.asyncio
     # async def test_permissions(self):
     #     notifications_: Notifications = self.bot.get_cog("notifications")